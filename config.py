@@ -15,6 +15,16 @@ log_format = '%(asctime)s %(levelname)s %(name)s: %(message)s'
 ### Server
 listening_port = 8081
 
+# every client watching the kiln gets its own queue of status updates, so
+# a slow browser only holds up itself. once this many updates are waiting
+# the oldest are dropped. with status_coalesce only the latest is kept.
+status_queue_size = 20
+status_coalesce = False
+
+# clients can ask /status?encoding=delta for only the fields that changed
+# each tick. every this many ticks they are sent the whole state again.
+status_keyframe_interval = 30
+
 ########################################################################
 # Local display options
 #
@@ -48,8 +58,8 @@ currency_type   = "£"   # Currency Symbol to show when calculating cost to run
 gpio_heat = 23  # Switches zero-cross solid-state-relay
 
 ### Thermocouple Adapter selection:
-#   max31855 - bitbang SPI interface
-#   max31856 - bitbang SPI interface. must specify thermocouple_type.
+#   max31855 - bitbang or hardware SPI interface
+#   max31856 - bitbang or hardware SPI interface. must specify thermocouple_type.
 max31855 = 0
 max31856 = 1
 # see lib/max31856.py for other thermocouple_type, only applies to max31856
@@ -63,7 +73,7 @@ gpio_sensor_cs = 26
 gpio_sensor_clock = 18
 gpio_sensor_data = 14
 gpio_sensor_di = 15 # only used with max31856
-gpio_spi = 1
+gpio_spi = 1 # 1 to bitbang, 0 to use hardware SPI below
 
 ### Thermocouple Connection (using hardware SPI)
 #spi_port = 0
@@ -112,6 +122,14 @@ sim_R_o_nocool = 0.5   # K/W  thermal resistance oven -> environment
 sim_R_o_cool   = 0.05   # K/W  " with cooling
 sim_R_ho_noair = 0.1    # K/W  thermal resistance heat element -> oven
 sim_R_ho_air   = 0.05   # K/W  " with internal air circulation
+# run the simulation this many times faster than real time. 1 is real
+# time, 60 fires a 10 hour schedule in 10 minutes.
+sim_speedup    = 1
+# with simulate = False, run the real kiln code (RealOven, the thermocouple
+# drivers and the heater output) against emulated boards driven by the sim_*
+# parameters, to test it without a Pi. sim_speedup makes the kiln heat and
+# cool faster, the controller still runs in real time.
+emulate = False
 
 
 ########################################################################
@@ -159,9 +177,37 @@ thermocouple_offset=0
 # you will likely need to increase this (eg I use 40)
 temperature_average_samples = 40 
 
+# the filters each thermocouple reading goes through, in order. each is a
+# (name, options) pair, one of
+#   ("median", {"window": 5})                     - median of the last readings
+#   ("trimmed_mean", {"window": 40, "chop": 25})  - mean without the top and
+#                                                   bottom chop percent
+#   ("exponential", {"alpha": 0.2})               - exponential moving average,
+#                                                   or {"time_constant": 10}
+#                                                   in seconds
+#   ("kalman", {"process_noise": 0.01, "measurement_noise": 4})
+#                                                 - or {"drift": 0.05, ...} in
+#                                                   degrees squared a second
+# readings are taken every sensor_time_wait / temperature_average_samples
+# seconds, late readings are logged and counted.
+# kiln-tuner.py filters compares them on your recorded firings.
+temperature_filters = [
+    ("trimmed_mean", {"window": temperature_average_samples, "chop": 25}),
+    ]
+
 # Thermocouple AC frequency filtering - set to True if in a 50Hz locale, else leave at False for 60Hz locale
 ac_freq_50hz = True
 
+# MAX31856 only. The chip converts continuously and can average
+# 2**max31856_avgsel conversions itself (0-4, 1 to 16 conversions) before
+# each new reading, at the cost of a reading every 82ms + 16.7ms for each
+# extra conversion at 60Hz (98ms + 20ms at 50Hz).
+max31856_avgsel = 0
+# read the MAX31856 once per new reading, paced to the chip, instead of
+# temperature_average_samples times every sensor_time_wait. each reading
+# is then fresh and none is read twice.
+max31856_paced = False
+
 ########################################################################
 # Emergencies - or maybe not
 ########################################################################
@@ -196,6 +242,10 @@ automatic_restarts = True
 automatic_restart_window = 15 # max minutes since power outage
 automatic_restart_state_file = os.path.abspath(os.path.join(os.path.dirname( __file__ ),'state.json'))
 
+# every firing is recorded to this sqlite database, to look at afterwards.
+# set to None to not keep a history.
+history_database = os.path.abspath(os.path.join(os.path.dirname( __file__ ),"storage", "history.sqlite"))
+
 ########################################################################
 # load kiln profiles from this directory
 # created a repo where anyone can contribute profiles. The objective is
@@ -30,8 +30,9 @@ script_dir = os.path.dirname(os.path.realpath(__file__))
 sys.path.insert(0, script_dir + '/lib/')
 profile_path = config.kiln_profiles_directory
 
-from oven import SimulatedOven, RealOven, Profile
-from ovenWatcher import OvenWatcher
+from oven import SimulatedOven, RealOven, Profile, ProfileRepository, VirtualClock
+from ovenWatcher import OvenWatcher, ENCODINGS
+from ovenRecorder import FiringHistory, FiringRecorder
 from ovenDisplay import OvenDisplay
 
 app = bottle.Bottle()
@@ -39,15 +40,25 @@ app = bottle.Bottle()
 if config.simulate == True:
     log.info("this is a simulation")
     oven = SimulatedOven()
+elif config.emulate == True:
+    log.info("this is a real kiln on emulated hardware")
+    from ovenEmulator import EmulatedKiln
+    oven = EmulatedKiln(speedup=config.sim_speedup).oven
 else:
     log.info("this is a real kiln")
     oven = RealOven()
 ovenWatcher = OvenWatcher(oven)
+firingHistory = None
+if config.history_database:
+    firingHistory = FiringHistory(config.history_database)
+    ovenWatcher.set_recorder(FiringRecorder(firingHistory))
+profiles = ProfileRepository(profile_path)
 ovenDisplay = OvenDisplay(oven, ovenWatcher, config.display_sleep_time)
 
 
-# this ovenwatcher is used in the oven class for restarts
+# this ovenwatcher and the profiles are used in the oven class for restarts
 oven.set_ovenwatcher(ovenWatcher)
+oven.set_profile_repository(profiles)
 
 @app.route('/')
 def index():
@@ -67,6 +78,45 @@ def handle_api():
     #     return "No pid"
 
 
+@app.get('/api/observers')
+def handle_observers():
+    log.info("/api/observers command received")
+    return json.dumps(ovenWatcher.observer_stats())
+
+@app.get('/api/history')
+def handle_history():
+    log.info("/api/history command received")
+    if firingHistory is None:
+        return { "success" : False, "error" : "firing history is not recorded" }
+    return json.dumps(firingHistory.firings())
+
+@app.get('/api/history/<run:int>')
+def handle_history_run(run):
+    '''
+    samples of one firing. start and end are seconds after it started,
+    points is how many to send at most (default 500)
+    '''
+    log.info("/api/history/%d command received" % run)
+    if firingHistory is None:
+        return { "success" : False, "error" : "firing history is not recorded" }
+    try:
+        start = bottle.request.query.get('start')
+        start = float(start) if start else None
+        end = bottle.request.query.get('end')
+        end = float(end) if end else None
+        points = max(2, min(int(bottle.request.query.get('points') or 500), 10000))
+    except ValueError:
+        return { "success" : False, "error" : "start, end and points must be numbers" }
+    samples = firingHistory.window(run, start, end, points)
+    if samples is None:
+        return { "success" : False, "error" : "firing %d not found" % run }
+    return json.dumps({
+        "firing": firingHistory.firing(run),
+        "start": start,
+        "end": end,
+        "points": samples,
+        })
+
 @app.post('/api')
 def handle_api():
     log.info("/api is alive")
@@ -82,13 +132,10 @@ def handle_api():
             startat = bottle.request.json['startat']
 
         # get the wanted profile/kiln schedule
-        profile = find_profile(wanted)
+        profile = profiles.get_profile(wanted)
         if profile is None:
             return { "success" : False, "error" : "profile %s not found" % wanted }
 
-        # FIXME juggling of json should happen in the Profile class
-        profile_json = json.dumps(profile)
-        profile = Profile(profile_json)
         oven.run_profile(profile,startat=startat)
         ovenWatcher.record(profile)
 
@@ -115,15 +162,7 @@ def find_profile(wanted):
     given a wanted profile name, find it and return the parsed
     json profile object or None.
     '''
-    #load all profiles from disk
-    profiles = get_profiles_json()
-    json_profiles = json.loads(profiles)
-
-    # find the wanted profile
-    for profile in json_profiles:
-        if profile['name'] == wanted:
-            return profile
-    return None
+    return profiles.get(wanted)
 
 @app.route('/picoreflow/:filename#.*#')
 def send_static(filename):
@@ -139,10 +178,66 @@ def get_websocket_from_request():
     return wsock
 
 
+def simulate_profile(wsock, profile, maxpts=500):
+    '''
+    fire profile on a private SimulatedOven with a VirtualClock, starting
+    from the current kiln temperature, and stream about maxpts predicted
+    states to wsock followed by a summary. runs in its own greenlet and
+    yields to the server between chunks of ticks. the real oven is never
+    touched.
+    '''
+    sim = SimulatedOven(clock=VirtualClock(), threaded=False)
+    temp = oven.get_state()['temperature']
+    if temp:
+        sim.t = sim.t_h = sim.board.temp_sensor.temperature = temp
+
+    every = max(1, int(profile.get_duration() / sim.time_step / maxpts))
+    ticks = 0
+    overshoot = 0
+    last = None
+    try:
+        for state in sim.fire(profile):
+            ticks += 1
+            if state['state'] != "RUNNING":
+                break
+            last = state
+            running = ticks
+            if state['runtime'] <= state['totaltime']:
+                overshoot = max(overshoot, state['temperature'] - state['target'])
+            if ticks % every == 0:
+                state['type'] = "simulation"
+                wsock.send(json.dumps(state))
+            if ticks % 100 == 0:
+                gevent.sleep(0)
+
+        if last is None:
+            summary = {'type': "simulation_summary", 'profile': profile.name,
+                       'completed': False, 'status': sim.status}
+        else:
+            # the first tick starts the clock, so time has moved on
+            # one time_step less than the number of ticks
+            elapsed = (running - 1) * sim.time_step
+            summary = {
+                'type': "simulation_summary",
+                'profile': profile.name,
+                'completed': last['runtime'] + sim.time_step >= last['totaltime'],
+                'duration': elapsed,
+                'overshoot': overshoot,
+                'lag': elapsed - last['runtime'],
+                'cost': last['cost'],
+                'currency_type': config.currency_type,
+            }
+        log.info("simulation of %s: %s" % (profile.name, summary))
+        wsock.send(json.dumps(summary))
+    except WebSocketError:
+        log.info("websocket (control) closed during simulation")
+
+
 @app.route('/control')
 def handle_control():
     wsock = get_websocket_from_request()
     log.info("websocket (control) opened")
+    preview = None
     while True:
         try:
             message = wsock.receive()
@@ -159,21 +254,22 @@ def handle_control():
                     ovenWatcher.record(profile)
                 elif msgdict.get("cmd") == "SIMULATE":
                     log.info("SIMULATE command received")
-                    #profile_obj = msgdict.get('profile')
-                    #if profile_obj:
-                    #    profile_json = json.dumps(profile_obj)
-                    #    profile = Profile(profile_json)
-                    #simulated_oven = Oven(simulate=True, time_step=0.05)
-                    #simulation_watcher = OvenWatcher(simulated_oven)
-                    #simulation_watcher.add_observer(wsock)
-                    #simulated_oven.run_profile(profile)
-                    #simulation_watcher.record(profile)
+                    profile_obj = msgdict.get('profile')
+                    if profile_obj:
+                        profile_json = json.dumps(profile_obj)
+                        profile = Profile(profile_json)
+                        # only one preview per socket at a time
+                        if preview:
+                            preview.kill()
+                        preview = gevent.spawn(simulate_profile, wsock, profile)
                 elif msgdict.get("cmd") == "STOP":
                     log.info("Stop command received")
                     oven.abort_run()
         except WebSocketError as e:
             log.error(e)
             break
+    if preview:
+        preview.kill()
     log.info("websocket (control) closed")
 
 
@@ -181,6 +277,9 @@ def handle_control():
 def handle_storage():
     wsock = get_websocket_from_request()
     log.info("websocket (storage) opened")
+    # clients that SYNC are sent only what changed after a PUT or DELETE,
+    # older ones that GET are sent the whole list
+    synced = None
     while True:
         try:
             message = wsock.receive()
@@ -196,13 +295,19 @@ def handle_storage():
             if message == "GET":
                 log.info("GET command received")
                 wsock.send(get_profiles_json())
+            elif msgdict.get("cmd") == "SYNC":
+                log.info("SYNC command received")
+                synced = profiles.changes(msgdict.get('revision'), msgdict.get('epoch'))
+                wsock.send(json.dumps(synced))
             elif msgdict.get("cmd") == "DELETE":
                 log.info("DELETE command received")
                 profile_obj = msgdict.get('profile')
                 if delete_profile(profile_obj):
                   msgdict["resp"] = "OK"
                 wsock.send(json.dumps(msgdict))
-                #wsock.send(get_profiles_json())
+                if synced:
+                    synced = profiles.changes(synced['revision'], synced['epoch'])
+                    wsock.send(json.dumps(synced))
             elif msgdict.get("cmd") == "PUT":
                 log.info("PUT command received")
                 profile_obj = msgdict.get('profile')
@@ -217,7 +322,11 @@ def handle_storage():
                     log.debug("websocket (storage) sent: %s" % message)
 
                     wsock.send(json.dumps(msgdict))
-                    wsock.send(get_profiles_json())
+                    if synced:
+                        synced = profiles.changes(synced['revision'], synced['epoch'])
+                        wsock.send(json.dumps(synced))
+                    else:
+                        wsock.send(get_profiles_json())
         except WebSocketError:
             break
     log.info("websocket (storage) closed")
@@ -239,7 +348,10 @@ def handle_config():
 @app.route('/status')
 def handle_status():
     wsock = get_websocket_from_request()
-    ovenWatcher.add_observer(wsock)
+    encoding = bottle.request.query.get('encoding', 'json')
+    if encoding not in ENCODINGS:
+        encoding = 'json'
+    ovenWatcher.add_observer(wsock, encoding)
     log.info("websocket (status) opened")
     while True:
         try:
@@ -247,45 +359,35 @@ def handle_status():
             wsock.send("Your message was: %r" % message)
         except WebSocketError:
             break
+    ovenWatcher.remove_observer(wsock)
     log.info("websocket (status) closed")
 
 def get_profiles():
-    try:
-        profile_files = os.listdir(profile_path)
-    except:
-        profile_files = []
-    profiles = []
-    for filename in profile_files:
-        with open(os.path.join(profile_path, filename), 'r') as f:
-            profiles.append(json.load(f))
-    return profiles
+    return profiles.all()
 
 def get_profiles_json():
-    return json.dumps(get_profiles())
+    return profiles.to_json()
+
+display_revision = None
+display_epoch = None
 
 def update_profiles():
-    ovenDisplay.update_profiles(get_profiles())
+    # the display is only sent the profiles changed since it last synced
+    global display_revision, display_epoch
+    changes = profiles.changes(display_revision, display_epoch)
+    if changes['full'] or changes['profiles'] or changes['deleted']:
+        ovenDisplay.update_profiles(changes)
+    display_revision = changes['revision']
+    display_epoch = changes['epoch']
 
 def save_profile(profile, force=False):
-    profile_json = json.dumps(profile)
-    filename = profile['name']+".json"
-    filepath = os.path.join(profile_path, filename)
-    if not force and os.path.exists(filepath):
-        log.error("Could not write, %s already exists" % filepath)
+    if not profiles.save(profile, force):
         return False
-    with open(filepath, 'w+') as f:
-        f.write(profile_json)
-        f.close()
-    log.info("Wrote %s" % filepath)
     update_profiles()
     return True
 
 def delete_profile(profile):
-    profile_json = json.dumps(profile)
-    filename = profile['name']+".json"
-    filepath = os.path.join(profile_path, filename)
-    os.remove(filepath)
-    log.info("Deleted %s" % filepath)
+    profiles.delete(profile)
     update_profiles()
     return True
 
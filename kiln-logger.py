@@ -6,6 +6,7 @@ import time
 import csv
 import argparse
 import sys
+import os
 
 
 STD_HEADER = [
@@ -38,8 +39,31 @@ PID_HEADER = [
 ]
 
 
-def logger(hostname, csvfile, noprofilestats, pidstats, stdout):
+def apply_delta(state, delta):
+    '''merge a delta from /status?encoding=delta into state'''
+    for gone in delta.get('removed', []):
+        state.pop(gone, None)
+    for k, v in delta.items():
+        if k == 'removed':
+            continue
+        if isinstance(v, dict) and isinstance(state.get(k), dict):
+            apply_delta(state[k], v)
+        else:
+            state[k] = v
+
+
+def logger(hostname, csvfile, noprofilestats, pidstats, stdout, delta, binary):
     status_ws = websocket.WebSocket()
+    url = f'ws://{hostname}/status'
+    if delta:
+        url += '?encoding=delta'
+    if binary:
+        url += '?encoding=binary'
+        # the frame layout is shared with the controller
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), 'lib'))
+        import ovenFrame
+    state = None
+    bad_message = (ValueError, ovenFrame.FrameError) if binary else (ValueError,)
 
     csv_fields = []
     if not noprofilestats:
@@ -59,19 +83,42 @@ def logger(hostname, csvfile, noprofilestats, pidstats, stdout):
 
     while True:
         try:
-            msg = json.loads(status_ws.recv())
+            raw = status_ws.recv()
+            if isinstance(raw, bytes):
+                msg = ovenFrame.unpack(raw)
+            else:
+                msg = json.loads(raw)
 
         except websocket.WebSocketException:
             try:
-                status_ws.connect(f'ws://{hostname}/status')
+                status_ws.connect(url)
+                state = None
             except Exception:
                 time.sleep(5)
 
             continue
 
+        except bad_message as e:
+            # skip it, binary frames are whole states and deltas wait for
+            # the next keyframe
+            print("skipping a bad status message: %s" % e, file=sys.stderr)
+            state = None
+            continue
+
         if msg.get('type') == 'backlog':
             continue
 
+        # only changed fields arrive between keyframes
+        if msg.get('type') == 'keyframe':
+            state = msg
+        elif msg.get('type') == 'delta' and state is not None:
+            apply_delta(state, msg)
+        if delta:
+            # nothing can be logged until the first keyframe
+            if state is None:
+                continue
+            msg = dict(state)
+
         if not noprofilestats:
             msg['stamp'] = time.time()
         if pidstats and 'pidstats' in msg:
@@ -97,6 +144,9 @@ if __name__ == "__main__":
     parser.add_argument('--pidstats', action='store_true', help="Include PID stats")
     parser.add_argument('--noprofilestats', action='store_true', help="Do not store profile stats (default is to store them)")
     parser.add_argument('--stdout', action='store_true', help="Also print to stdout")
+    encoding = parser.add_mutually_exclusive_group()
+    encoding.add_argument('--delta', action='store_true', help="Only receive the fields that change each tick")
+    encoding.add_argument('--binary', action='store_true', help="Receive binary frames instead of json")
     args = parser.parse_args()
 
-    logger(args.hostname, args.csvfile, args.noprofilestats, args.pidstats, args.stdout)
+    logger(args.hostname, args.csvfile, args.noprofilestats, args.pidstats, args.stdout, args.delta, args.binary)
@@ -5,6 +5,8 @@ import sys
 import csv
 import time
 import argparse
+import json
+import multiprocessing
 
 
 def recordprofile(csvfile, targettemp):
@@ -173,6 +175,436 @@ def calculate(filename, tangentdivisor, showplot):
              lower_crossing_x, upper_crossing_x)
 
 
+def read_firing(filename):
+    '''read a kiln-logger csv recorded with --pidstats and return the
+    sample times, temperatures and heater duty as numpy arrays'''
+    import numpy as np
+
+    times = []
+    temps = []
+    duty = []
+    with open(filename) as f:
+        for row in csv.DictReader(f):
+            try:
+                stamp = float(row.get('stamp') or row['pid_time'])
+                temp = float(row['temperature'])
+                # the element is only driven while a schedule runs
+                if row.get('state', 'RUNNING') == 'RUNNING':
+                    out = float(row['pid_out'])
+                else:
+                    out = 0.0
+            except KeyError:
+                print("%s needs time, temperature and pid_out columns, record it with kiln-logger.py --pidstats" % filename)
+                exit(1)
+            except ValueError:
+                continue  # just ignore bad values!
+            times.append(stamp)
+            temps.append(temp)
+            duty.append(min(max(out, 0.0), 1.0))
+    return np.array(times), np.array(temps), np.array(duty)
+
+
+def simulate_firings(firings, time_step, c_heat, p_heat, c_oven, R_o, R_ho, t_env):
+    '''drive the simulator's thermal model with the recorded duty of every
+    firing, for m parameter sets at once (each argument is a scalar or an
+    array of length m). returns one (samples, m) temperature array per firing'''
+    import numpy as np
+    from ovenBatch import BatchPlant
+
+    m = max(np.size(x) for x in (c_heat, p_heat, c_oven, R_o, R_ho, t_env))
+    predicted = []
+    for times, temps, duty in firings:
+        plant = BatchPlant(m, time_step=time_step, t_env=t_env, c_heat=c_heat,
+                           c_oven=c_oven, p_heat=p_heat, R_o_nocool=R_o, R_ho_noair=R_ho)
+        # assume the element starts at the same temperature as the kiln
+        plant.t[:] = temps[0]
+        plant.t_h[:] = temps[0]
+        out = np.empty((len(duty), m))
+        for k in range(len(duty)):
+            out[k] = plant.t
+            plant.step(duty[k])
+        predicted.append(out)
+    return predicted
+
+
+def fit_quality(firings, predicted):
+    import numpy as np
+
+    measured = np.concatenate([temps for (times, temps, duty) in firings])
+    predicted = np.concatenate(predicted)[:, 0]
+    err = predicted - measured
+    ss_res = np.sum(err ** 2)
+    ss_tot = np.sum((measured - measured.mean()) ** 2)
+    return {
+        'rmse': np.sqrt(np.mean(err ** 2)),
+        'max': np.max(np.abs(err)),
+        'r2': 1 - ss_res / ss_tot if ss_tot else 0.0,
+    }
+
+
+def initial_plant_estimate(firings, c_heat, p_heat):
+    '''
+    linear least squares on the integrated form of the continuous model
+
+        A T'' + B T' + (T - t_env) = C u
+        A = c_heat c_oven R_ho R_o, B = R_o (c_heat + c_oven) + c_heat R_ho, C = p_heat R_o
+
+    integrated twice from the start of each firing so no derivatives of the
+    noisy temperature are needed. each firing has its own unknown starting
+    slope and starting offset from t_env. returns (c_oven, R_o, R_ho, t_env)
+    or None if the data does not fit the model.
+    '''
+    import numpy as np
+
+    def integrate(y, tau):
+        return np.concatenate([[0], np.cumsum((y[1:] + y[:-1]) / 2 * np.diff(tau))])
+
+    nfirings = len(firings)
+    rows = []
+    targets = []
+    t0s = []
+    for i, (times, temps, duty) in enumerate(firings):
+        tau = times - times[0]
+        y = temps - temps[0]
+        Iy = integrate(y, tau)
+        IIy = integrate(Iy, tau)
+        IIu = integrate(integrate(duty, tau), tau)
+        cols = [IIu, -y, -Iy]
+        for j in range(nfirings):
+            cols.append(tau if i == j else np.zeros_like(tau))
+            cols.append(-tau ** 2 / 2 if i == j else np.zeros_like(tau))
+        rows.append(np.column_stack(cols))
+        targets.append(IIy)
+        t0s.append(temps[0])
+    X = np.concatenate(rows)
+    y = np.concatenate(targets)
+
+    # scale the columns, they span many orders of magnitude
+    scale = np.linalg.norm(X, axis=0)
+    scale[scale == 0] = 1
+    coef = np.linalg.lstsq(X / scale, y, rcond=None)[0] / scale
+    C, A, B = coef[:3]
+    t_env = np.mean([t0s[j] - coef[4 + 2 * j] for j in range(nfirings)])
+
+    if C <= 0 or A <= 0 or B <= 0:
+        return None
+    R_o = C / p_heat
+    K = A / (R_o * c_heat)      # c_oven * R_ho
+    M = B - R_o * c_heat        # R_o * c_oven + c_heat * R_ho
+    if M <= 0:
+        return None
+    # c_heat R_ho^2 - M R_ho + R_o K = 0, the smaller root keeps the
+    # element fast and the oven slow
+    disc = max(M ** 2 - 4 * c_heat * R_o * K, 0)
+    R_ho = (M - np.sqrt(disc)) / (2 * c_heat)
+    if R_ho <= 0:
+        return None
+    return (K / R_ho, R_o, R_ho, t_env)
+
+
+def fitsim(filenames, c_heat, p_heat, iterations):
+    config = load_simulator()
+    import numpy as np
+
+    firings = [read_firing(filename) for filename in filenames]
+    firings = [f for f in firings if len(f[0]) > 2]
+    if not firings:
+        print("No usable data found")
+        exit(1)
+    time_step = float(np.median(np.concatenate([np.diff(f[0]) for f in firings])))
+    measured = np.concatenate([f[1] for f in firings])
+    print("fitting %d samples from %d firings, time step %.2fs" % (len(measured), len(firings), time_step))
+
+    current = (config.sim_c_oven, config.sim_R_o_nocool, config.sim_R_ho_noair, config.sim_t_env)
+    guess = initial_plant_estimate(firings, c_heat, p_heat)
+    if guess is None:
+        print("linear estimate failed, starting from the current config")
+        guess = current
+
+    # refine against the discrete simulator itself with Levenberg-Marquardt.
+    # c_oven and the resistances are fitted as logs to keep them positive,
+    # every jacobian column is one more lane of the same simulation pass
+    theta = np.array([np.log(guess[0]), np.log(guess[1]), np.log(guess[2]), guess[3]])
+
+    def lanes_for(thetas):
+        thetas = np.atleast_2d(thetas)
+        return dict(c_oven=np.exp(thetas[:, 0]), R_o=np.exp(thetas[:, 1]),
+                    R_ho=np.exp(thetas[:, 2]), t_env=thetas[:, 3])
+
+    def residuals(thetas):
+        predicted = simulate_firings(firings, time_step, c_heat, p_heat, **lanes_for(thetas))
+        return np.concatenate(predicted) - measured[:, None]
+
+    steps = np.array([1e-4, 1e-4, 1e-4, 1e-2])
+    damping = 1e-3
+    r = residuals(theta)[:, 0]
+    cost = r @ r
+    for i in range(iterations):
+        probes = np.vstack([theta, theta + np.diag(steps)])
+        res = residuals(probes)
+        r = res[:, 0]
+        J = (res[:, 1:] - r[:, None]) / steps
+        JtJ = J.T @ J
+        g = J.T @ r
+        improved = False
+        while damping < 1e10:
+            delta = np.linalg.solve(JtJ + damping * np.diag(np.diag(JtJ) + 1e-12), -g)
+            candidate = theta + delta
+            rc = residuals(candidate)[:, 0]
+            if rc @ rc < cost:
+                theta, cost = candidate, rc @ rc
+                damping = max(damping / 10, 1e-9)
+                improved = True
+                break
+            damping *= 10
+        if not improved or np.max(np.abs(delta)) < 1e-6:
+            break
+
+    fitted = lanes_for(theta)
+    c_oven, R_o, R_ho, t_env = (fitted['c_oven'][0], fitted['R_o'][0], fitted['R_ho'][0], fitted['t_env'][0])
+
+    before = fit_quality(firings, simulate_firings(firings, time_step, config.sim_c_heat, config.sim_p_heat,
+                                                   *current))
+    after = fit_quality(firings, simulate_firings(firings, time_step, c_heat, p_heat, c_oven, R_o, R_ho, t_env))
+
+    print("")
+    print("%-20s %10s %10s %10s" % ('', 'rmse', 'max err', 'r2'))
+    print("%-20s %10.2f %10.2f %10.4f" % ('current config', before['rmse'], before['max'], before['r2']))
+    print("%-20s %10.2f %10.2f %10.4f" % ('fitted', after['rmse'], after['max'], after['r2']))
+    print("")
+    print("sim_t_env      = %.1f" % t_env)
+    print("sim_c_heat     = %.1f" % c_heat)
+    print("sim_c_oven     = %.1f" % c_oven)
+    print("sim_p_heat     = %.1f" % p_heat)
+    print("sim_R_o_nocool = %.4f" % R_o)
+    print("sim_R_ho_noair = %.4f" % R_ho)
+
+
+def replayfirings(filenames, profile_name, tolerance):
+    load_simulator()
+    from ovenReplay import read_log, load_profile, compare
+
+    print("%-30s %8s %9s %9s %8s %10s %10s %12s" %
+        ('firing', 'ticks', 'duty mae', 'duty max', 'heat !=', 'target mae', 'drift (s)', 'diverges at'))
+    start = time.time()
+    worst = 0
+    replayed = 0
+    skipped = 0
+    for filename in filenames:
+        samples = read_log(filename)
+        name = profile_name
+        if name is None:
+            names = [s['profile'] for s in samples if s.get('state') == 'RUNNING' and s.get('profile')]
+            name = names[0] if names else None
+        profile = load_profile(name) if name else None
+        if profile is None:
+            print("%-30s no profile %s found, use --profile" % (os.path.basename(filename), name))
+            skipped += 1
+            continue
+
+        result = compare(samples, profile, tolerance)
+        diverges = result['first_divergence']
+        print("%-30s %8d %9.4f %9.4f %8d %10.2f %10.1f %12s%s" %
+            (os.path.basename(filename), result['ticks'], result['duty_mae'], result['duty_max'],
+             result['heat_mismatch'], result['target_mae'], result['runtime_drift'],
+             '-' if diverges is None else '%.0f' % diverges,
+             ' ended early' if result['ended_early'] else ''))
+        worst = max(worst, result['duty_max'])
+        replayed += 1
+    print("replayed %d firings in %.2fs, %d skipped" % (replayed, time.time() - start, skipped))
+    # a firing that could not be replayed proves nothing, so it fails
+    return replayed > 0 and skipped == 0 and worst <= tolerance
+
+
+DEFAULT_FILTERS = [
+    [["trimmed_mean", {"window": 40, "chop": 25}]],
+    [["trimmed_mean", {"window": 10, "chop": 25}]],
+    [["median", {"window": 5}]],
+    [["exponential", {"alpha": 0.2}]],
+    [["kalman", {"process_noise": 0.01, "measurement_noise": 4}]],
+    [["median", {"window": 5}], ["kalman", {"process_noise": 0.01, "measurement_noise": 4}]],
+]
+
+def read_temperatures(filename):
+    '''the sample times and temperatures of any kiln-logger csv as numpy arrays'''
+    import numpy as np
+    from ovenReplay import read_log
+
+    samples = read_log(filename)
+    return (np.array([s['stamp'] for s in samples]),
+            np.array([s['temperature'] for s in samples]))
+
+def filter_lag(filtered, reference, maxlag):
+    '''the delay in samples that best lines filtered up with reference,
+    and the rms of what is left over'''
+    import numpy as np
+
+    best = (0, float('inf'))
+    for lag in range(0, maxlag + 1):
+        residual = filtered[maxlag:] - reference[maxlag - lag:len(reference) - lag]
+        rms = float(np.sqrt(np.mean(residual ** 2)))
+        if rms < best[1]:
+            best = (lag, rms)
+    return best
+
+def benchfilters(filenames, specs, noise, spikes, reference_window, seed):
+    '''
+    feed recorded temperatures through each filter chain and report how
+    much noise it leaves and how far it lags. the logged temperatures have
+    already been through the kiln's own filter, so --noise and --spikes add
+    gaussian noise and thermocouple glitches back before filtering. the
+    filtered temperatures are compared with a centered moving average of
+    the recording, which has no lag, at the delay that matches best.
+    '''
+    import numpy as np
+    load_simulator()
+    from sensorFilter import build_filters
+
+    rng = np.random.default_rng(seed)
+    print("%-30s %-60s %9s %9s %9s %9s" %
+        ('firing', 'filters', 'raw rms', 'rms', 'lag (s)', 'us/read'))
+    for filename in filenames:
+        (times, temps) = read_temperatures(filename)
+        n = len(temps)
+        half = reference_window // 2
+        maxlag = min(n // 4, 200)
+        if n < 2 * half + maxlag + 2:
+            print("%-30s too few samples" % os.path.basename(filename))
+            continue
+        step = float(np.median(np.diff(times)))
+
+        readings = temps + rng.normal(0, noise, n) if noise else temps.copy()
+        glitches = rng.random(n) < spikes
+        readings[glitches] += rng.choice([-1, 1], glitches.sum()) * rng.uniform(50, 500, glitches.sum())
+
+        # the reference at i is centered on i, so it is not delayed at all
+        kernel = np.ones(2 * half + 1) / (2 * half + 1)
+        reference = np.convolve(temps, kernel, mode='valid')
+        inner = slice(half, n - half)
+
+        for spec in specs:
+            chain = build_filters(spec)
+            start = time.perf_counter()
+            filtered = np.array([chain.add(float(t)) for t in readings])
+            elapsed = time.perf_counter() - start
+
+            (lag, rms) = filter_lag(filtered[inner], reference, maxlag)
+            raw = float(np.sqrt(np.mean((readings[inner] - reference) ** 2)))
+            print("%-30s %-60s %9.3f %9.3f %9.1f %9.2f" %
+                (os.path.basename(filename), json.dumps(spec, separators=(',', ':')),
+                 raw, rms, lag * step, elapsed / n * 1e6))
+
+
+def load_simulator():
+    try:
+        sys.dont_write_bytecode = True
+        import config
+        sys.dont_write_bytecode = False
+
+    except ImportError:
+        print("Could not import config file.")
+        print("Copy config.py.EXAMPLE to config.py and adapt it for your setup.")
+        exit(1)
+
+    script_dir = os.path.dirname(os.path.realpath(__file__))
+    sys.path.insert(0, script_dir + '/lib/')
+
+    return config
+
+
+def fire_candidates(job):
+    '''pool worker: fire every profile with one chunk of pid candidates
+    as a single batch and return the metrics summed over the profiles'''
+    profiles_json, kp, ki, kd = job
+    config = load_simulator()
+    import numpy as np
+    from oven import Profile
+    from ovenBatch import BatchSimulation
+
+    totals = {
+        'overshoot': np.zeros(len(kp)),
+        'error': np.zeros(len(kp)),
+        'behind': np.zeros(len(kp)),
+        'energy': np.zeros(len(kp)),
+        'cost': np.zeros(len(kp)),
+        'failed': np.zeros(len(kp), dtype=bool),
+    }
+    for profile_json in profiles_json:
+        profile = Profile(profile_json)
+        # start where the schedule passes the temperature of a cold kiln
+        startat = profile.calc_start_offset(config.sim_t_env)
+        sim = BatchSimulation([profile] * len(kp), kp=kp, ki=ki, kd=kd, startat=startat)
+        results = sim.run()
+        totals['overshoot'] = np.maximum(totals['overshoot'], results['overshoot'])
+        totals['error'] += results['iae'] / max(profile.get_duration() - startat, 1)
+        totals['behind'] += results['behind']
+        totals['energy'] += results['energy']
+        totals['cost'] += results['cost']
+        totals['failed'] |= ~results['completed']
+    return totals
+
+
+def optimize(profile_names, kp_range, ki_range, kd_range, steps, processes, weights, top):
+    config = load_simulator()
+    import numpy as np
+    from oven import ProfileRepository
+    from ovenBatch import param_grid
+
+    # load the real profiles to fire
+    profiles = []
+    for profile in ProfileRepository(config.kiln_profiles_directory).all():
+        if not profile_names or profile['name'] in profile_names:
+            profiles.append(json.dumps(profile))
+    if not profiles:
+        print("No profiles found to fire")
+        exit(1)
+
+    # candidates are spaced evenly on a log scale between min and max
+    axes = {}
+    for name, (lo, hi) in (('kp', kp_range), ('ki', ki_range), ('kd', kd_range)):
+        if lo == hi:
+            axes[name] = [lo]
+        else:
+            axes[name] = np.geomspace(lo, hi, steps)
+    grid = param_grid(**axes)
+    total = len(grid['kp'])
+
+    # one big batch per process, numpy does best with wide arrays
+    chunks = max(1, min(total, processes))
+    jobs = []
+    for idx in np.array_split(np.arange(total), chunks):
+        jobs.append((profiles, grid['kp'][idx], grid['ki'][idx], grid['kd'][idx]))
+
+    print("firing %d profiles with %d pid candidates on %d processes" % (len(profiles), total, processes))
+    start = time.time()
+    with multiprocessing.Pool(processes) as pool:
+        parts = pool.map(fire_candidates, jobs)
+    print("done in %.1fs" % (time.time() - start))
+
+    metrics = {k: np.concatenate([part[k] for part in parts]) for k in parts[0]}
+    score = (weights['overshoot'] * metrics['overshoot'] +
+             weights['error'] * metrics['error'] +
+             weights['behind'] * metrics['behind'] / 60 +
+             weights['cost'] * metrics['cost'])
+    # never recommend gains that hit an emergency or never finish
+    score[metrics['failed']] = np.inf
+
+    print("%10s %10s %10s %10s %10s %10s %10s %10s" %
+        ('kp', '1/ki', 'kd', 'score', 'overshoot', 'error', 'behind', 'cost'))
+    for i in np.argsort(score)[:top]:
+        print("%10.3f %10.3f %10.3f %10.3f %10.2f %10.2f %10.1f %10.2f" %
+            (grid['kp'][i], grid['ki'][i], grid['kd'][i], score[i], metrics['overshoot'][i],
+             metrics['error'][i], metrics['behind'][i] / 60, metrics['cost'][i]))
+
+    best = np.argmin(score)
+    if not np.isfinite(score[best]):
+        print("No candidate completed every profile, try wider ranges")
+        exit(1)
+    print("pid_kp = %s" % (grid['kp'][best]))
+    print("pid_ki = %s" % (grid['ki'][best]))
+    print("pid_kd = %s" % (grid['kd'][best]))
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Kiln tuner')
     subparsers = parser.add_subparsers()
@@ -189,6 +621,42 @@ if __name__ == "__main__":
     parser_zn.add_argument('--tangentdivisor', type=float, default=8, help="Adjust the tangent calculation to fit better. Must be >= 2 (default 8).")
     parser_zn.set_defaults(mode='zn')
 
+    parser_opt = subparsers.add_parser('optimize', help='Search for PID parameters by simulating firings of your profiles')
+    parser_opt.add_argument('--profile', action='append', default=[], help="Name of a profile to fire, may be repeated (default all profiles)")
+    parser_opt.add_argument('--kp', type=float, nargs=2, default=[1, 200], metavar=('MIN', 'MAX'), help="Range of pid_kp to search (default 1 200)")
+    parser_opt.add_argument('--ki', type=float, nargs=2, default=[1, 500], metavar=('MIN', 'MAX'), help="Range of pid_ki to search, inverted as in config (default 1 500)")
+    parser_opt.add_argument('--kd', type=float, nargs=2, default=[1, 1000], metavar=('MIN', 'MAX'), help="Range of pid_kd to search (default 1 1000)")
+    parser_opt.add_argument('--steps', type=int, default=10, help="Values to try between MIN and MAX of each range (default 10)")
+    parser_opt.add_argument('--processes', type=int, default=multiprocessing.cpu_count(), help="Worker processes (default one per core)")
+    parser_opt.add_argument('--overshoot-weight', type=float, default=1, help="Score per degree of worst overshoot (default 1)")
+    parser_opt.add_argument('--error-weight', type=float, default=1, help="Score per degree of mean absolute error (default 1)")
+    parser_opt.add_argument('--behind-weight', type=float, default=1, help="Score per minute behind schedule (default 1)")
+    parser_opt.add_argument('--cost-weight', type=float, default=0, help="Score per unit of currency spent (default 0)")
+    parser_opt.add_argument('--top', type=int, default=10, help="How many of the best candidates to list (default 10)")
+    parser_opt.set_defaults(mode='optimize')
+
+    parser_fit = subparsers.add_parser('fitsim', help='Fit the simulation parameters to recorded firings')
+    parser_fit.add_argument('csvfile', type=str, nargs='+', help="CSV files recorded with kiln-logger.py --pidstats")
+    parser_fit.add_argument('--c-heat', type=float, default=None, help="Heat capacity of the elements in J/K, held fixed (default sim_c_heat from config)")
+    parser_fit.add_argument('--p-heat', type=float, default=None, help="Power of the elements in W, held fixed (default kw_elements from config)")
+    parser_fit.add_argument('--iterations', type=int, default=50, help="Maximum refinement iterations (default 50)")
+    parser_fit.set_defaults(mode='fitsim')
+
+    parser_replay = subparsers.add_parser('replay', help='Replay recorded firings through the controller and compare its decisions with the log')
+    parser_replay.add_argument('csvfile', type=str, nargs='+', help="CSV files recorded with kiln-logger.py --pidstats")
+    parser_replay.add_argument('--profile', type=str, default=None, help="Name of the profile that was fired (default the name in the log)")
+    parser_replay.add_argument('--tolerance', type=float, default=0.05, help="Difference in pid output (0-1) that counts as diverging (default 0.05)")
+    parser_replay.set_defaults(mode='replay')
+
+    parser_filters = subparsers.add_parser('filters', help='Compare temperature filters on recorded firings')
+    parser_filters.add_argument('csvfile', type=str, nargs='+', help="CSV files recorded with kiln-logger.py")
+    parser_filters.add_argument('--filter', type=json.loads, action='append', default=[], help='A filter chain to try as JSON in temperature_filters form, eg \'[["median", {"window": 5}]]\', may be repeated (default a selection)')
+    parser_filters.add_argument('--noise', type=float, default=1.0, help="Standard deviation of the gaussian noise added to the readings in degrees (default 1)")
+    parser_filters.add_argument('--spikes', type=float, default=0.01, help="Fraction of readings turned into glitches of 50 to 500 degrees (default 0.01)")
+    parser_filters.add_argument('--reference-window', type=int, default=15, help="Samples in the centered moving average the filters are compared with (default 15)")
+    parser_filters.add_argument('--seed', type=int, default=0, help="Seed for the added noise (default 0)")
+    parser_filters.set_defaults(mode='filters')
+
     args = parser.parse_args()
 
     if args.mode == 'recordprofile':
@@ -200,6 +668,31 @@ if __name__ == "__main__":
 
         calculate(args.csvfile, args.tangentdivisor, args.showplot)
 
+    elif args.mode == 'optimize':
+        if args.steps < 1:
+            raise ValueError("steps must be >= 1")
+
+        weights = {'overshoot': args.overshoot_weight,
+                   'error': args.error_weight,
+                   'behind': args.behind_weight,
+                   'cost': args.cost_weight}
+        optimize(args.profile, args.kp, args.ki, args.kd, args.steps,
+                 args.processes, weights, args.top)
+
+    elif args.mode == 'fitsim':
+        config = load_simulator()
+        c_heat = config.sim_c_heat if args.c_heat is None else args.c_heat
+        p_heat = config.kw_elements * 1000 if args.p_heat is None else args.p_heat
+        fitsim(args.csvfile, c_heat, p_heat, args.iterations)
+
+    elif args.mode == 'replay':
+        if not replayfirings(args.csvfile, args.profile, args.tolerance):
+            exit(1)
+
+    elif args.mode == 'filters':
+        benchfilters(args.csvfile, args.filter or DEFAULT_FILTERS, args.noise,
+                     args.spikes, args.reference_window, args.seed)
+
     elif args.mode == '':
         parser.print_help()
         exit(1)
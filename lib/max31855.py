@@ -1,6 +1,10 @@
 #!/usr/bin/python
-import RPi.GPIO as GPIO
 import math
+try:
+    import RPi.GPIO as GPIO
+except ImportError:
+    # only the bitbang driver needs it, not MAX31855SPI
+    GPIO = None
 
 class MAX31855(object):
     '''Python driver for [MAX38155 Cold-Junction Compensated Thermocouple-to-Digital Converter](http://www.maximintegrated.com/datasheet/index.mvp/id/7273)
@@ -9,7 +13,7 @@ class MAX31855(object):
      - A [Raspberry Pi](http://www.raspberrypi.org/)
 
     '''
-    def __init__(self, cs_pin, clock_pin, data_pin, units = "c", board = GPIO.BCM):
+    def __init__(self, cs_pin, clock_pin, data_pin, units = "c", board = None, gpio = None):
         '''Initialize Soft (Bitbang) SPI bus
 
         Parameters:
@@ -18,24 +22,30 @@ class MAX31855(object):
         - data_pin:  Data input (SO / MOSI) pin (Any GPIO)
         - units:     (optional) unit of measurement to return. ("c" (default) | "k" | "f")
         - board:     (optional) pin numbering method as per RPi.GPIO library (GPIO.BCM (default) | GPIO.BOARD)
+        - gpio:      (optional) a module or object with the RPi.GPIO interface to use instead of RPi.GPIO
 
         '''
+        if gpio is None:
+            gpio = GPIO
+        if gpio is None:
+            raise MAX31855Error("RPi.GPIO is needed to bitbang the MAX31855")
+        self.GPIO = gpio
         self.cs_pin = cs_pin
         self.clock_pin = clock_pin
         self.data_pin = data_pin
         self.units = units
         self.data = None
-        self.board = board
+        self.board = gpio.BCM if board is None else board
         self.noConnection = self.shortToGround = self.shortToVCC = self.unknownError = False
 
         # Initialize needed GPIO
-        GPIO.setmode(self.board)
-        GPIO.setup(self.cs_pin, GPIO.OUT)
-        GPIO.setup(self.clock_pin, GPIO.OUT)
-        GPIO.setup(self.data_pin, GPIO.IN)
+        self.GPIO.setmode(self.board)
+        self.GPIO.setup(self.cs_pin, self.GPIO.OUT)
+        self.GPIO.setup(self.clock_pin, self.GPIO.OUT)
+        self.GPIO.setup(self.data_pin, self.GPIO.IN)
 
         # Pull chip select high to make chip inactive
-        GPIO.output(self.cs_pin, GPIO.HIGH)
+        self.GPIO.output(self.cs_pin, self.GPIO.HIGH)
 
     def get(self):
         '''Reads SPI bus and returns current value of thermocouple.'''
@@ -53,16 +63,16 @@ class MAX31855(object):
         '''Reads 32 bits of the SPI bus & stores as an integer in self.data.'''
         bytesin = 0
         # Select the chip
-        GPIO.output(self.cs_pin, GPIO.LOW)
+        self.GPIO.output(self.cs_pin, self.GPIO.LOW)
         # Read in 32 bits
         for i in range(32):
-            GPIO.output(self.clock_pin, GPIO.LOW)
+            self.GPIO.output(self.clock_pin, self.GPIO.LOW)
             bytesin = bytesin << 1
-            if (GPIO.input(self.data_pin)):
+            if (self.GPIO.input(self.data_pin)):
                 bytesin = bytesin | 1
-            GPIO.output(self.clock_pin, GPIO.HIGH)
+            self.GPIO.output(self.clock_pin, self.GPIO.HIGH)
         # Unselect the chip
-        GPIO.output(self.cs_pin, GPIO.HIGH)
+        self.GPIO.output(self.cs_pin, self.GPIO.HIGH)
         # Save data
         self.data = bytesin
 
@@ -128,8 +138,8 @@ class MAX31855(object):
 
     def cleanup(self):
         '''Selective GPIO cleanup'''
-        GPIO.setup(self.cs_pin, GPIO.IN)
-        GPIO.setup(self.clock_pin, GPIO.IN)
+        self.GPIO.setup(self.cs_pin, self.GPIO.IN)
+        self.GPIO.setup(self.clock_pin, self.GPIO.IN)
 
     def data_to_LinearizedTempC(self, data_32 = None):
         '''Return the NIST-linearized thermocouple temperature value in degrees
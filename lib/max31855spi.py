@@ -1,36 +1,92 @@
 #!/usr/bin/python
-import logging
+import time
 
-from Adafruit_MAX31855 import MAX31855
+import Adafruit_GPIO.SPI as SPI
 
-class MAX31855SPI(object):
-    '''Python driver for [MAX38155 Cold-Junction Compensated Thermocouple-to-Digital Converter](http://www.maximintegrated.com/datasheet/index.mvp/id/7273)
+from max31855 import MAX31855, MAX31855Error
+
+class MAX31855SPI(MAX31855):
+    '''MAX31855 on the hardware SPI bus through the kernel spidev driver.
+     The frame is read in one 4 byte transfer instead of clocking 32 bits
+     through GPIO calls, and decoded by the MAX31855 methods.
      Requires:
-     - adafruit's MAX31855 SPI-only device library
+     - [Adafruit_GPIO](https://github.com/adafruit/Adafruit_Python_GPIO)
+     - spidev enabled (raspi-config, Interface Options, SPI)
 
     '''
-    def __init__(self, spi_dev):
-        self.max31855 = MAX31855.MAX31855(spi=spi_dev)
-        self.log = logging.getLogger(__name__)
-
-    def get(self):
-        '''Reads SPI bus and returns current value of thermocouple.'''
-        state = self.max31855.readState()
-        self.log.debug("status %s" % state)
-        if state['openCircuit']:
-            raise MAX31855Error('Not Connected')
-        elif state['shortGND']:
-            raise MAX31855Error('Short to Ground')
-        elif state['shortVCC']:
-            raise MAX31855Error('Short to VCC')
-        elif state['fault']:
-            raise MAX31855Error('Unknown Error')
-        return self.max31855.readLinearizedTempC()
-
-
-class MAX31855SPIError(Exception):
-    def __init__(self, value):
-        self.value = value
-
-    def __str__(self):
-        return repr(self.value)
+    def __init__(self, port=0, device=0, units = "c", spi = None):
+        '''Initialize hardware SPI
+
+        Parameters:
+        - port:      SPI bus, /dev/spidev<port>.<device>
+        - device:    chip select on that bus
+        - units:     (optional) unit of measurement to return. ("c" (default) | "k" | "f")
+        - spi:       (optional) an Adafruit_GPIO.SPI style device to use instead of opening spidev
+
+        '''
+        self.units = units
+        self.data = None
+        self.noConnection = self.shortToGround = self.shortToVCC = self.unknownError = False
+
+        if spi is None:
+            spi = SPI.SpiDev(port, device)
+        self._spi = spi
+        # the MAX31855 is good for 5MHz, samples SO on the falling edge
+        # of SCK (mode 0) and sends D31 first
+        self._spi.set_clock_hz(5000000)
+        self._spi.set_mode(0)
+        self._spi.set_bit_order(SPI.MSBFIRST)
+
+    def read(self):
+        '''Reads 32 bits of the SPI bus & stores as an integer in self.data.'''
+        raw = self._spi.read(4)
+        if raw is None or len(raw) != 4:
+            raise MAX31855Error('Did not read expected number of bytes from device!')
+        self.data = (raw[0] << 24) | (raw[1] << 16) | (raw[2] << 8) | raw[3]
+
+    def cleanup(self):
+        '''Release the spidev device'''
+        self._spi.close()
+
+
+def time_reads(thermocouple, reads):
+    '''microseconds taken by each of reads calls to thermocouple.get()'''
+    times = []
+    for i in range(reads):
+        start = time.perf_counter()
+        thermocouple.get()
+        times.append((time.perf_counter() - start) * 1e6)
+    return sorted(times)
+
+if __name__ == "__main__":
+
+    # Compare how long a read takes bitbanged and through hardware SPI.
+    # Wire the same MAX31855 to both, or run each on its own with
+    # --skip-bitbang or --skip-spi.
+    import argparse
+    parser = argparse.ArgumentParser(description='MAX31855 read latency')
+    parser.add_argument('--cs', type=int, default=5, help="Bitbang chip select pin (BCM)")
+    parser.add_argument('--clock', type=int, default=4, help="Bitbang clock pin (BCM)")
+    parser.add_argument('--data', type=int, default=17, help="Bitbang data pin (BCM)")
+    parser.add_argument('--port', type=int, default=0, help="Hardware SPI bus")
+    parser.add_argument('--device', type=int, default=0, help="Hardware SPI chip select")
+    parser.add_argument('--reads', type=int, default=1000, help="Reads to time with each driver")
+    parser.add_argument('--skip-bitbang', action='store_true')
+    parser.add_argument('--skip-spi', action='store_true')
+    args = parser.parse_args()
+
+    drivers = []
+    if not args.skip_bitbang:
+        drivers.append(("bitbang", lambda: MAX31855(args.cs, args.clock, args.data)))
+    if not args.skip_spi:
+        drivers.append(("spidev", lambda: MAX31855SPI(args.port, args.device)))
+
+    print("{:10} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+        "driver", "temp", "mean us", "median us", "p99 us", "max us"))
+    for name, make in drivers:
+        thermocouple = make()
+        times = time_reads(thermocouple, args.reads)
+        print("{:10} {:10.2f} {:10.1f} {:10.1f} {:10.1f} {:10.1f}".format(
+            name, thermocouple.get(), sum(times) / len(times), times[len(times) // 2],
+            times[int(len(times) * 0.99)], times[-1]))
+        thermocouple.cleanup()
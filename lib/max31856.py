@@ -79,6 +79,13 @@ class MAX31856(object):
     MAX31856_CR0_READ_ONE = 0x40 # One shot reading, delay approx. 200ms then read temp registers
     MAX31856_CR0_READ_CONT = 0x80 # Continuous reading, delay approx. 100ms between readings
 
+    # Conversion time in continuous mode, see data sheet Table 3 (in Rev. 0): the first
+    # conversion of a reading plus one per extra averaged sample, in seconds
+    MAX31856_CONT_CONVERSION_60HZ = (0.082, 1.0/60)
+    MAX31856_CONT_CONVERSION_50HZ = (0.098, 1.0/50)
+    # Samples averaged for each avgsel (CR1 bits 6:4), anything above 4 is 16
+    MAX31856_AVERAGED_SAMPLES = (1, 2, 4, 8, 16)
+
     # Thermocouple Types
     MAX31856_B_TYPE = 0x0 # Read B Type Thermocouple
     MAX31856_E_TYPE = 0x1 # Read E Type Thermocouple
@@ -89,7 +96,7 @@ class MAX31856(object):
     MAX31856_S_TYPE = 0x6 # Read S Type Thermocouple
     MAX31856_T_TYPE = 0x7 # Read T Type Thermocouple
 
-    def __init__(self, tc_type=MAX31856_S_TYPE, units="c", avgsel=0x0, ac_freq_50hz=False, ocdetect=0x1, software_spi=None, hardware_spi=None, gpio=None):
+    def __init__(self, tc_type=MAX31856_S_TYPE, units="c", avgsel=0x0, ac_freq_50hz=False, ocdetect=0x1, software_spi=None, hardware_spi=None, gpio=None, spi=None):
         """
         Initialize MAX31856 device with software SPI on the specified CLK,
         CS, and DO pins.  Alternatively can specify hardware SPI by sending an
@@ -108,16 +115,23 @@ class MAX31856(object):
                 do (integer): Pin number for software SPI MISO
                 di (integer): Pin number for software SPI MOSI
             hardware_spi (SPI.SpiDev): If using hardware SPI, define the connection
+            spi: An already open device with the Adafruit_GPIO.SPI interface, used instead of
+                software_spi or hardware_spi
         """
         self._logger = logging.getLogger('Adafruit_MAX31856.MAX31856')
         self._spi = None
         self.tc_type = tc_type
         self.avgsel = avgsel
+        self.ac_freq_50hz = ac_freq_50hz
         self.units = units
+        self.internal_temp = None
         self.noConnection = self.shortToGround = self.shortToVCC = self.unknownError = False
 
         # Handle hardware SPI
-        if hardware_spi is not None:
+        if spi is not None:
+            self._logger.debug('Using given SPI device')
+            self._spi = spi
+        elif hardware_spi is not None:
             self._logger.debug('Using hardware SPI')
             self._spi = SPI.SpiDev(hardware_spi['port'], hardware_spi['device'])
         elif software_spi is not None:
@@ -203,6 +217,22 @@ class MAX31856(object):
 
         return temp_c
 
+    def averaged_samples(self):
+        """
+        Return the number of conversions the MAX31856 averages for each reading.
+        """
+        return self.MAX31856_AVERAGED_SAMPLES[min(self.avgsel & 7, 4)]
+
+    def conversion_period(self):
+        """
+        Return the seconds between new readings in continuous conversion mode.
+        """
+        if self.ac_freq_50hz:
+            first, extra = self.MAX31856_CONT_CONVERSION_50HZ
+        else:
+            first, extra = self.MAX31856_CONT_CONVERSION_60HZ
+        return first + (self.averaged_samples() - 1) * extra
+
     def read_internal_temp_c(self):
         """
         Return internal temperature value in degrees celsius.
@@ -229,6 +259,27 @@ class MAX31856(object):
 
         return temp_c
 
+    def read_conversion(self):
+        """
+        Return the thermocouple temperature, cold junction temperature (both in degrees celsius)
+        and fault register of one conversion.
+
+        Note:
+            The registers from CJTH to FAULT are read in a single burst, so this costs one SPI
+            transaction instead of six and the temperatures and faults always come from the same
+            conversion.
+        """
+        (cj_high, cj_low, tc_high, tc_mid, tc_low, fault) = self._read_registers(
+            self.MAX31856_REG_READ_CJTH, 6)
+
+        temp_c = MAX31856._thermocouple_temp_from_bytes(tc_low, tc_mid, tc_high)
+        cj_temp_c = MAX31856._cj_temp_from_bytes(cj_high, cj_low)
+        if self._logger.isEnabledFor(logging.DEBUG):
+            self._logger.debug("Thermocouple Temperature {0} deg. C, Cold Junction Temperature {1} deg. C, "
+                               "Fault 0x{2:02X}".format(temp_c, cj_temp_c, fault))
+
+        return temp_c, cj_temp_c, fault
+
     def read_fault_register(self):
         """Return bytes containing fault codes and hardware problems.
 
@@ -261,6 +312,30 @@ class MAX31856(object):
             (address & 0xFFFF), (value & 0xFFFF)))
         return value
 
+    def _read_registers(self, address, count):
+        """
+        Reads count consecutive registers starting at address from the MAX31856
+
+        Args:
+            address (8-bit Hex): Address of the first register.  Constants listed in class as
+                MAX31856_REG_READ_*
+            count (integer): Number of registers to read
+
+        Note:
+            The MAX31856 moves on to the next register address for every byte clocked out while
+            chip select stays low, so one transfer of the address followed by count dummy bytes
+            returns them all.
+        """
+        raw = self._spi.transfer([address] + [0x00] * count)
+        if raw is None or len(raw) != count + 1:
+            raise RuntimeError('Did not read expected number of bytes from device!')
+
+        values = list(raw[1:])
+        if self._logger.isEnabledFor(logging.DEBUG):
+            self._logger.debug('Read Registers: 0x{0:02X}, Raw Values: {1}'.format(
+                (address & 0xFFFF), ' '.join('0x{0:02X}'.format(v & 0xFF) for v in values)))
+        return values
+
     def _write_register(self, address, write_value):
         """
         Writes to a register at address from the MAX31856
@@ -303,14 +378,15 @@ class MAX31856(object):
         '''Convert celsius to fahrenheit.'''
         return celsius * 9.0/5.0 + 32
 
-    def checkErrors(self):
-        data = self.read_fault_register()
+    def checkErrors(self, data=None):
+        if data is None:
+            data = self.read_fault_register()
         self.noConnection = (data & 0x00000001) != 0
         self.unknownError = (data & 0xfe) != 0
 
     def get(self):
-        self.checkErrors()
-        celcius = self.read_temp_c()
+        celcius, self.internal_temp, fault = self.read_conversion()
+        self.checkErrors(fault)
         return getattr(self, "to_" + self.units)(celcius)
 
 
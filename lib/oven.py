@@ -1,4 +1,6 @@
 import threading
+import bisect
+import functools
 import time
 import random
 import datetime
@@ -6,6 +8,8 @@ import logging
 import json
 import config
 import os
+from sensorFilter import build_filters
+from sensorFaults import FaultTracker
 
 log = logging.getLogger(__name__)
 
@@ -29,14 +33,111 @@ class Duplogger():
 duplog = Duplogger().logref()
 
 
+class Clock(object):
+    '''wall clock. everything in the oven that needs to know the time or
+       wait for time to pass goes through one of these, so a simulation
+       can swap in a faster clock'''
+    def now(self):
+        return datetime.datetime.now()
+
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+class ScaledClock(Clock):
+    '''runs speedup times faster than the wall clock. safe to share
+       between threads, so the oven and the watcher stay in step'''
+    def __init__(self, speedup=1):
+        self.speedup = float(speedup)
+        self.real_start = time.time()
+
+    def time(self):
+        return self.real_start + (time.time() - self.real_start) * self.speedup
+
+    def now(self):
+        return datetime.datetime.fromtimestamp(self.time())
+
+    def sleep(self, seconds):
+        time.sleep(seconds / self.speedup)
+
+class VirtualClock(Clock):
+    '''only moves forward when sleep is called, so a firing runs as fast
+       as the cpu allows. use with a single thread calling Oven.step'''
+    def __init__(self, start=None):
+        if start is None:
+            start = time.time()
+        self.t = start
+
+    def time(self):
+        return self.t
+
+    def now(self):
+        return datetime.datetime.fromtimestamp(self.t)
+
+    def sleep(self, seconds):
+        self.t += seconds
+
+
+class Cadence(object):
+    '''
+    wakes every period seconds on time.monotonic(). each wake up is due
+    a whole number of periods after the first, so time spent reading a
+    sensor and sleeping late never adds up into a drifting period. when
+    the work overruns the next wake up, the ticks missed are skipped and
+    counted rather than run back to back, and it carries on in step.
+    '''
+    def __init__(self, period, monotonic=time.monotonic, sleep=time.sleep):
+        self.period = period
+        self.monotonic = monotonic
+        self.sleep = sleep
+        self.start = None
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+
+    def wait(self):
+        '''sleep until the next tick is due and return the time.monotonic()
+        it woke at, the time to stamp a sample taken now with'''
+        now = self.monotonic()
+        if self.start is None:
+            self.start = now
+            return now
+        self.ticks += 1
+        due = self.start + self.ticks * self.period
+        if now > due:
+            # wait for the next tick that can still be made on time
+            missed = int((now - due) // self.period) + 1
+            self.overruns += 1
+            self.skipped += missed
+            self.ticks += missed
+            if self.overruns == 1 or self.overruns % 100 == 0:
+                log.warning("sampling fell behind by %.3fs, %d overruns %d ticks skipped so far" %
+                    (now - due, self.overruns, self.skipped))
+            due = self.start + self.ticks * self.period
+        self.sleep(due - now)
+        return self.monotonic()
+
+    def stats(self):
+        return {'period': self.period,
+                'ticks': self.ticks,
+                'overruns': self.overruns,
+                'skipped': self.skipped}
+
+
 class Output(object):
-    def __init__(self):
+    def __init__(self, gpio=None):
+        '''gpio is RPi.GPIO unless something with the same interface is
+           passed in, like ovenEmulator.EmulatedGPIO'''
         self.active = False
-        self.load_libs()
+        self.load_libs(gpio)
 
-    def load_libs(self):
+    def load_libs(self, gpio=None):
         try:
-            import RPi.GPIO as GPIO
+            GPIO = gpio
+            if GPIO is None:
+                import RPi.GPIO as GPIO
             GPIO.setmode(GPIO.BCM)
             GPIO.setwarnings(False)
             GPIO.setup(config.gpio_heat, GPIO.OUT)
@@ -58,13 +159,13 @@ class Output(object):
 
 # FIX - Board class needs to be completely removed
 class Board(object):
-    def __init__(self):
+    def __init__(self, thermocouple=None):
         self.name = None
         self.active = False
         self.temp_sensor = None
         self.gpio_active = False
         self.load_libs()
-        self.create_temp_sensor()
+        self.create_temp_sensor(thermocouple)
         self.temp_sensor.start()
 
     def load_libs(self):
@@ -88,11 +189,11 @@ class Board(object):
                 msg = "max31856 config set, but import failed"
                 log.warning(msg)
 
-    def create_temp_sensor(self):
+    def create_temp_sensor(self, thermocouple=None):
         if config.simulate == True:
             self.temp_sensor = TempSensorSimulate()
         else:
-            self.temp_sensor = TempSensorReal()
+            self.temp_sensor = TempSensorReal(thermocouple)
 
 class BoardSimulated(object):
     def __init__(self):
@@ -103,10 +204,23 @@ class TempSensor(threading.Thread):
         threading.Thread.__init__(self)
         self.daemon = True
         self.temperature = 0
-        self.bad_percent = 0
         self.time_step = config.sensor_time_wait
+        self.faults = FaultTracker(self.time_step * 2)
+        self.cadence = None
         self.noConnection = self.shortToGround = self.shortToVCC = self.unknownError = False
 
+    def sampling(self):
+        '''the sample period and how often reading fell behind it, None
+           for sensors that are not read on a Cadence'''
+        if self.cadence is None:
+            return None
+        return self.cadence.stats()
+
+    @property
+    def bad_percent(self):
+        '''percentage of bad readings over the last two time_steps'''
+        return self.faults.percent()
+
 class TempSensorSimulated(TempSensor):
     '''not much here, just need to be able to set the temperature'''
     def __init__(self):
@@ -114,23 +228,34 @@ class TempSensorSimulated(TempSensor):
 
 class TempSensorReal(TempSensor):
     '''real temperature sensor thread that takes N measurements
-       during the time_step'''
-    def __init__(self):
+       during the time_step. the thermocouple board is built from config
+       unless an already built driver is passed in'''
+    def __init__(self, thermocouple=None):
         TempSensor.__init__(self)
         self.sleeptime = self.time_step / float(config.temperature_average_samples)
-        self.bad_count = 0
-        self.ok_count = 0
-        self.bad_stamp = 0
+        self.cadence = Cadence(self.sleeptime)
+        self.filter = build_filters(config.temperature_filters)
 
-        if config.max31855:
+        if thermocouple is not None:
+            self.thermocouple = thermocouple
+
+        elif config.max31855:
             log.info("init MAX31855")
-            from max31855 import MAX31855, MAX31855Error
-            self.thermocouple = MAX31855(config.gpio_sensor_cs,
-                                     config.gpio_sensor_clock,
-                                     config.gpio_sensor_data,
-                                     config.temp_scale)
+            if config.gpio_spi:
+                log.info("using software SPI")
+                from max31855 import MAX31855, MAX31855Error
+                self.thermocouple = MAX31855(config.gpio_sensor_cs,
+                                         config.gpio_sensor_clock,
+                                         config.gpio_sensor_data,
+                                         config.temp_scale)
+            else:
+                log.info("using hardware SPI")
+                from max31855spi import MAX31855SPI
+                self.thermocouple = MAX31855SPI(config.spi_port,
+                                                config.spi_device,
+                                                config.temp_scale)
 
-        if config.max31856:
+        elif config.max31856:
             log.info("init MAX31856")
             from max31856 import MAX31856
             if config.gpio_spi:
@@ -151,21 +276,20 @@ class TempSensorReal(TempSensor):
                                          hardware_spi = hardware_spi,
                                          units = config.temp_scale,
                                          ac_freq_50hz = config.ac_freq_50hz,
+                                         avgsel = config.max31856_avgsel,
                                          )
 
+        if config.max31856 and config.max31856_paced:
+            # one read per new conversion, a little after it is ready
+            self.sleeptime = self.thermocouple.conversion_period() * 1.02
+            self.cadence = Cadence(self.sleeptime)
+            log.info("reading MAX31856 every %.3fs, averaging %d conversions" %
+                (self.sleeptime, self.thermocouple.averaged_samples()))
+
     def run(self):
         '''use a moving average of config.temperature_average_samples across the time_step'''
-        temps = []
         while True:
-            # reset error counter if time is up
-            if (time.time() - self.bad_stamp) > (self.time_step * 2):
-                if self.bad_count + self.ok_count:
-                    self.bad_percent = (self.bad_count / (self.bad_count + self.ok_count)) * 100
-                else:
-                    self.bad_percent = 0
-                self.bad_count = 0
-                self.ok_count = 0
-                self.bad_stamp = time.time()
+            stamp = self.cadence.wait()
 
             temp = self.thermocouple.get()
             self.noConnection = self.thermocouple.noConnection
@@ -173,45 +297,32 @@ class TempSensorReal(TempSensor):
             self.shortToVCC = self.thermocouple.shortToVCC
             self.unknownError = self.thermocouple.unknownError
 
-            is_bad_value = self.noConnection | self.unknownError
+            kinds = [kind for kind in ('noConnection', 'unknownError') if getattr(self, kind)]
             if not config.ignore_tc_short_errors:
-                is_bad_value |= self.shortToGround | self.shortToVCC
+                kinds += [kind for kind in ('shortToGround', 'shortToVCC') if getattr(self, kind)]
+            self.faults.add(stamp, kinds)
 
-            if not is_bad_value:
-                temps.append(temp)
-                if len(temps) > config.temperature_average_samples:
-                    del temps[0]
-                self.ok_count += 1
+            if not kinds:
+                self.temperature = self.filter.add(temp, stamp)
 
             else:
                 log.error("Problem reading temp N/C:%s GND:%s VCC:%s ???:%s" % (self.noConnection,self.shortToGround,self.shortToVCC,self.unknownError))
-                self.bad_count += 1
-
-            if len(temps):
-                self.temperature = self.get_avg_temp(temps)
-            time.sleep(self.sleeptime)
-
-    def get_avg_temp(self, temps, chop=25):
-        '''
-        strip off chop percent from the beginning and end of the sorted temps
-        then return the average of what is left
-        '''
-        chop = chop / 100
-        temps = sorted(temps)
-        total = len(temps)
-        items = int(total*chop)
-        temps = temps[items:total-items]
-        return sum(temps) / len(temps)
 
 class Oven(threading.Thread):
     '''parent oven class. this has all the common code
-       for either a real or simulated oven'''
+       for either a real or simulated oven. subclasses must set
+       self.clock before calling this'''
+    # set on ovens that fire offline, to keep per tick logging quiet
+    quiet = False
+
     def __init__(self):
         threading.Thread.__init__(self)
         self.daemon = True
         self.temperature = 0
         self.time_step = config.sensor_time_wait
         self.restart_failed = False
+        self.automatic_restarts = config.automatic_restarts
+        self.profile_repository = ProfileRepository(config.kiln_profiles_directory)
         self.reset()
 
     def reset(self):
@@ -224,7 +335,7 @@ class Oven(threading.Thread):
         self.target = 0
         self.heat = 0
         self.status = ""
-        self.pid = PID(ki=config.pid_ki, kd=config.pid_kd, kp=config.pid_kp)
+        self.pid = PID(ki=config.pid_ki, kd=config.pid_kd, kp=config.pid_kp, clock=self.clock, quiet=self.quiet)
 
     def run_profile(self, profile, startat=0):
         self.reset()
@@ -248,7 +359,7 @@ class Oven(threading.Thread):
 
         self.startat = startat
         self.runtime = self.startat
-        self.start_time = datetime.datetime.now() - datetime.timedelta(seconds=self.startat)
+        self.start_time = self.clock.now() - datetime.timedelta(seconds=self.startat)
         self.profile = profile
         self.totaltime = profile.get_duration()
         self.state = "RUNNING"
@@ -267,17 +378,19 @@ class Oven(threading.Thread):
                 config.thermocouple_offset
             # kiln too cold, wait for it to heat up
             if self.target - temp > config.pid_control_window:
-                log.info("kiln must catch up, too cold, shifting schedule")
+                if not self.quiet:
+                    log.info("kiln must catch up, too cold, shifting schedule")
                 self.status = "Kiln must catch up, too cold"
-                self.start_time = datetime.datetime.now() - datetime.timedelta(milliseconds = self.runtime * 1000)
+                self.start_time = self.clock.now() - datetime.timedelta(milliseconds = self.runtime * 1000)
             # kiln too hot, wait for it to cool down
             if temp - self.target > config.pid_control_window:
-                log.info("kiln must catch up, too hot, shifting schedule")
+                if not self.quiet:
+                    log.info("kiln must catch up, too hot, shifting schedule")
                 self.status = "Kiln must catch up, too hot"
-                self.start_time = datetime.datetime.now() - datetime.timedelta(milliseconds = self.runtime * 1000)
+                self.start_time = self.clock.now() - datetime.timedelta(milliseconds = self.runtime * 1000)
 
     def update_runtime(self):
-        runtime_delta = datetime.datetime.now() - self.start_time
+        runtime_delta = self.clock.now() - self.start_time
         if runtime_delta.total_seconds() < 0:
             runtime_delta = datetime.timedelta(0)
 
@@ -309,7 +422,7 @@ class Oven(threading.Thread):
             if config.ignore_unknown_tc_error == False:
                 self.abort_run()
 
-        if self.board.temp_sensor.bad_percent > 30:
+        if self.board.temp_sensor.faults.percent() > 30:
             log.info("emergency!!! too many errors in a short period")
             self.status = "Emergency! Too many errors in a short period"
             if config.ignore_too_many_tc_errors == False:
@@ -351,6 +464,8 @@ class Oven(threading.Thread):
             'currency_type': config.currency_type,
             'profile': self.profile.name if self.profile else None,
             'pidstats': self.pid.pidstats,
+            'faults': self.board.temp_sensor.faults.state(),
+            'sampling': self.board.temp_sensor.sampling(),
         }
         return state
 
@@ -373,13 +488,13 @@ class Oven(threading.Thread):
 
     def save_automatic_restart_state(self):
         # only save state if the feature is enabled
-        if not config.automatic_restarts == True:
+        if not self.automatic_restarts == True:
             return False
         self.save_state()
 
     def should_i_automatic_restart(self):
         # only automatic restart if the feature is enabled and hasn't failed
-        if (not config.automatic_restarts) or (self.restart_failed):
+        if (not self.automatic_restarts) or (self.restart_failed):
             return False
         if self.state_file_is_old():
             duplog.info("automatic restart not possible. state file does not exist or is too old.")
@@ -395,13 +510,10 @@ class Oven(threading.Thread):
     def automatic_restart(self):
         with open(config.automatic_restart_state_file) as infile: d = json.load(infile)
         startat = d["runtime"]
-        filename = "%s.json" % (d["profile"])
-        profile_path = os.path.abspath(os.path.join(os.path.dirname( __file__ ), '..', 'storage','profiles',filename))
-
-        log.info("automatically restarting profile = %s at minute = %d" % (profile_path,startat))
-        with open(profile_path) as infile:
-            profile_json = json.dumps(json.load(infile))
-        profile = Profile(profile_json)
+        log.info("automatically restarting profile = %s at minute = %d" % (d["profile"],startat))
+        profile = self.profile_repository.get_profile(d["profile"])
+        if profile is None:
+            raise Exception("profile %s not found" % d["profile"])
         self.run_profile(profile,startat=startat)
         self.cost = d["cost"]
         time.sleep(1)
@@ -411,6 +523,10 @@ class Oven(threading.Thread):
         log.info("ovenwatcher set in oven class")
         self.ovenwatcher = watcher
 
+    def set_profile_repository(self, repository):
+        '''share the web server's profiles instead of keeping a second copy'''
+        self.profile_repository = repository
+
     def run(self):
         while True:
             if self.state == "IDLE":
@@ -423,25 +539,37 @@ class Oven(threading.Thread):
                     self.restart_failed = True
                 continue
             if self.state == "RUNNING":
-                try:
-                    self.status = ""
-                    self.update_cost()
-                    self.save_automatic_restart_state()
-                    self.kiln_must_catch_up()
-                    self.update_runtime()
-                    self.update_target_temp()
-                    self.heat_then_cool()
-                    self.reset_if_emergency()
-                    self.reset_if_schedule_ended()
-                except Exception as err:
-                    log.error("Unexpected during run: " + str(err))
-                    self.abort_run()
-                    self.status = "ERR:" + str(err)
+                self.step()
                 continue
 
+    def step(self):
+        '''one time_step of a running schedule. called from run, or directly
+           in a loop when driving the oven with a VirtualClock'''
+        try:
+            self.status = ""
+            self.update_cost()
+            self.save_automatic_restart_state()
+            self.kiln_must_catch_up()
+            self.update_runtime()
+            self.update_target_temp()
+            self.heat_then_cool()
+            self.reset_if_emergency()
+            self.reset_if_schedule_ended()
+        except Exception as err:
+            log.error("Unexpected during run: " + str(err))
+            self.abort_run()
+            self.status = "ERR:" + str(err)
+
 class SimulatedOven(Oven):
 
-    def __init__(self):
+    def __init__(self, clock=None, threaded=True):
+        '''clock defaults to a ScaledClock running config.sim_speedup times
+           faster than real time. pass threaded=False with a VirtualClock to
+           step the oven yourself, as fast as the cpu allows'''
+        if clock is None:
+            clock = ScaledClock(config.sim_speedup)
+        self.clock = clock
+        self.quiet = not threaded
         self.board = BoardSimulated()
         self.t_env = config.sim_t_env
         self.c_heat = config.sim_c_heat
@@ -454,12 +582,34 @@ class SimulatedOven(Oven):
         # set temps to the temp of the surrounding environment
         self.t = self.t_env # deg C temp of oven
         self.t_h = self.t_env #deg C temp of heating element
+        self.board.temp_sensor.temperature = self.t
 
         super().__init__()
 
         # start thread
-        self.start()
-        log.info("SimulatedOven started")
+        if threaded:
+            self.start()
+            log.info("SimulatedOven started")
+        else:
+            # a preview or tuning run must not overwrite the restart state
+            # of the real kiln
+            self.automatic_restarts = False
+
+    def fire(self, profile, startat=0, max_time=None):
+        '''run a whole profile on an oven built with threaded=False,
+           yielding the state after every time_step. gives up after
+           max_time seconds (default three times the schedule)'''
+        if max_time is None:
+            max_time = 3 * profile.get_duration()
+        self.run_profile(profile, startat=startat)
+        elapsed = 0
+        while self.state == "RUNNING" and elapsed <= max_time:
+            self.step()
+            elapsed += self.time_step
+            yield self.get_state()
+        if self.state == "RUNNING":
+            log.info("simulation of %s gave up after %d seconds" % (profile.name, elapsed))
+            self.abort_run()
 
     def heating_energy(self,pid):
         # using pid here simulates the element being on for
@@ -498,41 +648,47 @@ class SimulatedOven(Oven):
         if heat_on > 0:
             self.heat = heat_on
 
-        log.info("simulation: -> %dW heater: %.0f -> %dW oven: %.0f -> %dW env"            % (int(self.p_heat * pid),
-            self.t_h,
-            int(self.p_ho),
-            self.t,
-            int(self.p_env)))
+        # offline simulations fire thousands of ticks a second,
+        # don't flood the log with them
+        if not self.quiet:
+            log.info("simulation: -> %dW heater: %.0f -> %dW oven: %.0f -> %dW env"            % (int(self.p_heat * pid),
+                self.t_h,
+                int(self.p_ho),
+                self.t,
+                int(self.p_env)))
 
-        time_left = self.totaltime - self.runtime
+            time_left = self.totaltime - self.runtime
 
-        try:
-            log.info("temp=%.2f, target=%.2f, error=%.2f, pid=%.2f, p=%.2f, i=%.2f, d=%.2f, heat_on=%.2f, heat_off=%.2f, run_time=%d, total_time=%d, time_left=%d" %
-                (self.pid.pidstats['ispoint'],
-                self.pid.pidstats['setpoint'],
-                self.pid.pidstats['err'],
-                self.pid.pidstats['pid'],
-                self.pid.pidstats['p'],
-                self.pid.pidstats['i'],
-                self.pid.pidstats['d'],
-                heat_on,
-                heat_off,
-                self.runtime,
-                self.totaltime,
-                time_left))
-        except KeyError:
-            pass
+            try:
+                log.info("temp=%.2f, target=%.2f, error=%.2f, pid=%.2f, p=%.2f, i=%.2f, d=%.2f, heat_on=%.2f, heat_off=%.2f, run_time=%d, total_time=%d, time_left=%d" %
+                    (self.pid.pidstats['ispoint'],
+                    self.pid.pidstats['setpoint'],
+                    self.pid.pidstats['err'],
+                    self.pid.pidstats['pid'],
+                    self.pid.pidstats['p'],
+                    self.pid.pidstats['i'],
+                    self.pid.pidstats['d'],
+                    heat_on,
+                    heat_off,
+                    self.runtime,
+                    self.totaltime,
+                    time_left))
+            except KeyError:
+                pass
 
         # we don't actually spend time heating & cooling during
         # a simulation, so sleep.
-        time.sleep(self.time_step)
+        self.clock.sleep(self.time_step)
 
 
 class RealOven(Oven):
 
-    def __init__(self):
-        self.board = Board()
-        self.output = Output()
+    def __init__(self, board=None, output=None):
+        '''board and output are built from config unless passed in, see
+           ovenEmulator for a kiln with no hardware'''
+        self.clock = Clock()
+        self.board = board or Board()
+        self.output = output or Output()
         self.reset()
 
         # call parent init
@@ -579,11 +735,78 @@ class RealOven(Oven):
         except KeyError:
             pass
 
+class ProfileError(Exception):
+     def __init__(self, value):
+         self.value = value
+     def __str__(self):
+         return repr(self.value)
+
+def compile_segments(segments, start=0):
+    '''
+    turn a list of segments into the [time, temp] points of Profile.data,
+    starting from start degrees at time 0. each segment is one of:
+        {"rate": 100, "target": 600}    - go to 600 degrees at 100 degrees
+                                          per hour, heating or a controlled cool
+        {"rate": "max", "target": 1000} - go to 1000 degrees at config.max_ramp
+        {"hold": 10}                    - stay at the temperature for 10 minutes
+    raises ProfileError for anything else. the compiled points are cached,
+    so compiling the same segments again costs a json.dumps.
+    '''
+    try:
+        key = json.dumps([segments, start], sort_keys=True, allow_nan=False)
+    except (TypeError, ValueError):
+        raise ProfileError("segments must be json, with no NaN or infinite numbers")
+    return [list(point) for point in _compile_segments(key)]
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+@functools.lru_cache(maxsize=256)
+def _compile_segments(key):
+    (segments, start) = json.loads(key)
+    if not isinstance(segments, list) or not segments:
+        raise ProfileError("segments must be a list with at least one segment")
+    if not _is_number(start):
+        raise ProfileError("start must be a number, not %r" % (start,))
+
+    time = 0
+    temp = start
+    points = [(time, temp)]
+    for i, segment in enumerate(segments):
+        if not isinstance(segment, dict):
+            raise ProfileError("segment %d is not an object" % i)
+        keys = set(segment.keys())
+        if keys == set(["hold"]):
+            hold = segment["hold"]
+            if not _is_number(hold) or hold < 0:
+                raise ProfileError("segment %d hold must be minutes >= 0, not %r" % (i, hold))
+            time += hold * 60
+        elif keys == set(["rate", "target"]):
+            rate = segment["rate"]
+            target = segment["target"]
+            if rate == "max":
+                rate = config.max_ramp
+            if not _is_number(rate) or rate <= 0:
+                raise ProfileError("segment %d rate must be degrees/hour > 0 or \"max\", not %r" % (i, segment["rate"]))
+            if not _is_number(target):
+                raise ProfileError("segment %d target must be a number, not %r" % (i, target))
+            time += abs(target - temp) * 3600 / rate
+            temp = target
+        else:
+            raise ProfileError("segment %d must be {rate, target} or {hold}, not %s" % (i, sorted(keys)))
+        if time > points[-1][0]:
+            points.append((time, temp))
+    return tuple(points)
+
 class Profile():
     def __init__(self, json_data):
         obj = json.loads(json_data)
         self.name = obj["name"]
+        # segments win over data, which is their compiled form
+        if "segments" in obj:
+            obj["data"] = compile_segments(obj["segments"], obj.get("start", 0))
         self.data = sorted(obj["data"])
+        self.compile()
 
     def calc_start_offset(self, current_temp):
         log.info("Current temp is: " + str(current_temp))
@@ -611,49 +834,259 @@ class Profile():
         log.info("No offset calculated")   
         return 0
 
+    def compile(self):
+        '''precompute the points as sorted times, temps and the slope of the
+        segment ending at each point, so lookups are a bisect not a scan'''
+        self.times = [float(t) for (t, x) in self.data]
+        self.temps = [float(x) for (t, x) in self.data]
+        self.slopes = [0.0]
+        for i in range(1, len(self.data)):
+            dt = self.times[i] - self.times[i-1]
+            if dt > 0:
+                self.slopes.append((self.temps[i] - self.temps[i-1]) / dt)
+            else:
+                self.slopes.append(0.0)
+        self.duration = self.times[-1] if self.times else 0
+        self.arrays = None
+
     def get_duration(self):
-        return max([t for (t, x) in self.data])
+        return self.duration
 
     def get_surrounding_points(self, time):
-        if time > self.get_duration():
+        if time > self.duration:
             return (None, None)
 
-        prev_point = None
-        next_point = None
-
-        for i in range(len(self.data)):
-            if time < self.data[i][0]:
-                prev_point = self.data[i-1]
-                next_point = self.data[i]
-                break
-
-        return (prev_point, next_point)
+        i = bisect.bisect_right(self.times, time)
+        if i == len(self.data):
+            return (None, None)
+        return (self.data[i-1], self.data[i])
 
     def get_target_temperature(self, time):
-        if time > self.get_duration():
+        if time > self.duration:
             log.info("Time is after duration, target is zero")
             log.info("time = " + str(time))
-            log.info("duration = " + str(self.get_duration()))
+            log.info("duration = " + str(self.duration))
             return 0
 
-        (prev_point, next_point) = self.get_surrounding_points(time)
-        log.debug("Prev point" + str(prev_point))
-        log.debug("Next point" + str(next_point))
-
-        incl = float(next_point[1] - prev_point[1]) / float(next_point[0] - prev_point[0])
-        temp = prev_point[1] + (time - prev_point[0]) * incl
-
-        log.info("Incl:" + str(incl) + " Temp:" + str(temp))
+        i = bisect.bisect_right(self.times, time)
+        # a VirtualClock lands exactly on the last point
+        if i == len(self.times):
+            return self.temps[-1]
+        if i == 0:
+            return self.temps[0]
+        return self.temps[i-1] + (time - self.times[i-1]) * self.slopes[i]
+
+    def get_target_temperatures(self, times):
+        '''get_target_temperature for a whole array of times at once.
+        returns a numpy array'''
+        import numpy as np
+        if self.arrays is None:
+            self.arrays = (np.array(self.times), np.array(self.temps),
+                np.array(self.slopes))
+        (p_times, p_temps, p_slopes) = self.arrays
+        times = np.asarray(times, dtype=float)
+        n = len(p_times)
+        if n < 2:
+            temps = np.full(times.shape, p_temps[0] if n else 0.0)
+        else:
+            i = np.searchsorted(p_times, times, side='right')
+            seg = np.clip(i, 1, n - 1)
+            temps = p_temps[seg-1] + (times - p_times[seg-1]) * p_slopes[seg]
+            temps = np.where(i == 0, p_temps[0], temps)
+            temps = np.where(i == n, p_temps[-1], temps)
+        return np.where(times > self.duration, 0.0, temps)
+
+class ProfileRepository(object):
+    '''the profiles in a directory, parsed once and kept in memory by name.
+    each file is re-read only when its mtime or size changes, so looking
+    up a profile costs a listdir and a stat per file, not a parse. safe to
+    share between the web server, the oven and the display.
+
+    every change bumps revision, and the revision each profile was last
+    changed or deleted at is kept, so clients holding an older revision
+    can be sent only what changed since (see changes)'''
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        # filename -> (mtime, size, parsed json or None if unreadable,
+        #              Profile or None until first asked for)
+        self.files = {}
+        self.names = {}
+        self.profiles = []
+        self.json = None
+        # revisions restart with the process, the epoch tells clients so
+        self.epoch = "%x" % int(time.time() * 1000)
+        self.revision = 0
+        self.changed = {}
+        self.deleted = {}
+
+    def refresh(self):
+        '''re-read any files that changed on disk since the last call'''
+        try:
+            filenames = os.listdir(self.directory)
+        except OSError:
+            filenames = []
+        with self.lock:
+            changed = False
+            for filename in list(self.files):
+                if filename not in filenames:
+                    del self.files[filename]
+                    changed = True
+            for filename in filenames:
+                path = os.path.join(self.directory, filename)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entry = self.files.get(filename)
+                if entry and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+                    continue
+                try:
+                    with open(path, 'r') as f:
+                        obj = json.load(f)
+                    if "segments" in obj:
+                        obj["data"] = compile_segments(obj["segments"], obj.get("start", 0))
+                except (OSError, ValueError, ProfileError) as e:
+                    log.error("could not read profile %s: %s" % (path, e))
+                    obj = None
+                self.files[filename] = (st.st_mtime_ns, st.st_size, obj, None)
+                changed = True
+            if changed:
+                self.reindex()
+
+    def reindex(self):
+        # call with the lock held
+        old = dict((obj.get('name'), obj) for obj in self.profiles)
+        self.names = {}
+        self.profiles = []
+        for filename in sorted(self.files):
+            obj = self.files[filename][2]
+            if obj is not None:
+                self.names[obj.get('name')] = filename
+                self.profiles.append(obj)
+        self.json = None
+
+        new = dict((obj.get('name'), obj) for obj in self.profiles)
+        changed = [name for name in new if old.get(name) is not new[name]]
+        deleted = [name for name in old if name not in new]
+        if changed or deleted:
+            self.revision += 1
+        for name in changed:
+            self.changed[name] = self.revision
+            self.deleted.pop(name, None)
+        for name in deleted:
+            self.deleted[name] = self.revision
+            self.changed.pop(name, None)
+
+    def all(self):
+        '''every profile as parsed json. do not modify them'''
+        self.refresh()
+        with self.lock:
+            return list(self.profiles)
+
+    def to_json(self):
+        '''all profiles as a json list, only re-serialised after a change'''
+        self.refresh()
+        with self.lock:
+            if self.json is None:
+                self.json = json.dumps(self.profiles)
+            return self.json
+
+    def changes(self, revision=None, epoch=None):
+        '''
+        what a client holding revision (from epoch) is missing, as a dict:
+            type     - "profiles"
+            epoch    - pass back with the revision next time
+            revision - the revision the client holds after applying this
+            full     - True if profiles is the whole list, to replace what
+                       the client has. sent when the client has nothing
+                       or its revision is from an earlier epoch
+            profiles - the added or changed profiles
+            deleted  - names of profiles deleted since revision
+        '''
+        self.refresh()
+        with self.lock:
+            full = revision is None or epoch != self.epoch or revision > self.revision
+            if full:
+                profiles = list(self.profiles)
+                deleted = []
+            else:
+                profiles = [obj for obj in self.profiles
+                            if self.changed.get(obj.get('name'), 0) > revision]
+                deleted = [name for (name, rev) in self.deleted.items() if rev > revision]
+            return {
+                'type': "profiles",
+                'epoch': self.epoch,
+                'revision': self.revision,
+                'full': full,
+                'profiles': profiles,
+                'deleted': deleted,
+            }
+
+    def get(self, name):
+        '''the parsed json profile called name, or None'''
+        self.refresh()
+        with self.lock:
+            filename = self.names.get(name)
+            if filename is None:
+                return None
+            return self.files[filename][2]
+
+    def get_profile(self, name):
+        '''the Profile called name, or None. compiled once per file version'''
+        self.refresh()
+        with self.lock:
+            filename = self.names.get(name)
+            if filename is None:
+                return None
+            (mtime, size, obj, profile) = self.files[filename]
+            if profile is None:
+                profile = Profile(json.dumps(obj))
+                self.files[filename] = (mtime, size, obj, profile)
+            return profile
+
+    def save(self, profile, force=False):
+        filename = profile['name'] + ".json"
+        filepath = os.path.join(self.directory, filename)
+        if not force and os.path.exists(filepath):
+            log.error("Could not write, %s already exists" % filepath)
+            return False
+        # the compiled points are saved too, for anything that only reads data
+        if "segments" in profile:
+            try:
+                profile = dict(profile)
+                profile["data"] = compile_segments(profile["segments"], profile.get("start", 0))
+            except ProfileError as e:
+                log.error("Could not write %s: %s" % (filepath, e))
+                return False
+        with self.lock:
+            with open(filepath, 'w+') as f:
+                f.write(json.dumps(profile))
+            st = os.stat(filepath)
+            self.files[filename] = (st.st_mtime_ns, st.st_size, profile, None)
+            self.reindex()
+        log.info("Wrote %s" % filepath)
+        return True
 
-        return temp
+    def delete(self, profile):
+        filename = profile['name'] + ".json"
+        filepath = os.path.join(self.directory, filename)
+        with self.lock:
+            os.remove(filepath)
+            self.files.pop(filename, None)
+            self.reindex()
+        log.info("Deleted %s" % filepath)
+        return True
 
 class PID():
 
-    def __init__(self, ki=1, kp=1, kd=1):
+    def __init__(self, ki=1, kp=1, kd=1, clock=None, quiet=False):
         self.ki = ki
         self.kp = kp
         self.kd = kd
-        self.lastNow = datetime.datetime.now()
+        self.clock = clock or Clock()
+        self.quiet = quiet
+        self.lastNow = self.clock.now()
         self.iterm = 0
         self.lastErr = 0
         self.pidstats = {}
@@ -664,7 +1097,7 @@ class PID():
     # in a larger PID control window and much more accurate control...
     # instead of what used to be binary on/off control.
     def compute(self, setpoint, ispoint):
-        now = datetime.datetime.now()
+        now = self.clock.now()
         timeDelta = (now - self.lastNow).total_seconds()
 
         window_size = 100
@@ -682,18 +1115,22 @@ class PID():
         status = ''
         if error < (-1 * config.pid_control_window):
             status = "Kiln outside pid control window, max cooling"
-            log.info("kiln outside pid control window, max cooling")
+            if not self.quiet:
+                log.info("kiln outside pid control window, max cooling")
             output = 0
             # it is possible to set self.iterm=0 here and also below
             # but I dont think its needed
         elif error > (1 * config.pid_control_window):
             status = "Kiln outside pid control window, max heating"
-            log.info("kiln outside pid control window, max heating")
+            if not self.quiet:
+                log.info("kiln outside pid control window, max heating")
             output = 1
         else:
             icomp = (error * timeDelta * (1/self.ki))
             self.iterm += (error * timeDelta * (1/self.ki))
-            dErr = (error - self.lastErr) / timeDelta
+            # a VirtualClock can compute twice without time passing
+            if timeDelta > 0:
+                dErr = (error - self.lastErr) / timeDelta
             output = self.kp * error + self.iterm + self.kd * dErr
             output = sorted([-1 * window_size, output, window_size])[1]
             out4logs = output
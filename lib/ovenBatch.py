@@ -0,0 +1,222 @@
+import logging
+import itertools
+import numpy as np
+import config
+
+log = logging.getLogger(__name__)
+
+# These classes run the SimulatedOven thermal model and the PID controller
+# for many independent ovens in lock-step numpy arrays. Each tick does exactly
+# what Oven.step does for a SimulatedOven driven by a VirtualClock, so a single
+# lane reproduces the scalar simulation. Use them to sweep PID gains or plant
+# parameters across whole firings.
+
+def lanes(value, n):
+    '''broadcast a scalar or sequence to a float array with one entry per oven'''
+    return np.array(np.broadcast_to(np.asarray(value, dtype=float), (n,)))
+
+def param_grid(**axes):
+    '''every combination of the given parameter lists, as flat arrays
+    suitable for passing straight to BatchSimulation.
+
+    param_grid(kp=[10,20], ki=[50,100]) -> {'kp': [10,10,20,20], 'ki': [50,100,50,100]}
+    '''
+    names = list(axes.keys())
+    combos = list(itertools.product(*[axes[name] for name in names]))
+    return {name: np.array([c[i] for c in combos], dtype=float)
+            for i, name in enumerate(names)}
+
+
+class BatchPlant(object):
+    '''the SimulatedOven heat element -> oven -> environment model for n ovens'''
+    def __init__(self, n, time_step=None, t_env=None, c_heat=None, c_oven=None,
+                 p_heat=None, R_o_nocool=None, R_ho_noair=None):
+        def default(value, setting):
+            return lanes(setting if value is None else value, n)
+
+        self.n = n
+        self.time_step = config.sensor_time_wait if time_step is None else time_step
+        self.t_env = default(t_env, config.sim_t_env)
+        self.c_heat = default(c_heat, config.sim_c_heat)
+        self.c_oven = default(c_oven, config.sim_c_oven)
+        self.p_heat = default(p_heat, config.sim_p_heat)
+        self.R_o_nocool = default(R_o_nocool, config.sim_R_o_nocool)
+        self.R_ho = default(R_ho_noair, config.sim_R_ho_noair)
+
+        # set temps to the temp of the surrounding environment
+        self.t = self.t_env.copy()
+        self.t_h = self.t_env.copy()
+
+    def step(self, pid):
+        '''advance every oven by one time_step with its element on for
+        the pid fraction of it. same equations as SimulatedOven'''
+        Q_h = self.p_heat * self.time_step * pid
+        self.t_h += Q_h / self.c_heat
+        p_ho = (self.t_h - self.t) / self.R_ho
+        self.t += p_ho * self.time_step / self.c_oven
+        self.t_h -= p_ho * self.time_step / self.c_heat
+        p_env = (self.t - self.t_env) / self.R_o_nocool
+        self.t -= p_env * self.time_step / self.c_oven
+        return self.t
+
+
+class BatchPID(object):
+    '''PID.compute for n controllers at once'''
+    def __init__(self, n, kp=None, ki=None, kd=None):
+        self.kp = lanes(config.pid_kp if kp is None else kp, n)
+        self.ki = lanes(config.pid_ki if ki is None else ki, n)
+        self.kd = lanes(config.pid_kd if kd is None else kd, n)
+        self.iterm = np.zeros(n)
+        self.lastErr = np.zeros(n)
+
+    def compute(self, setpoint, ispoint, timeDelta):
+        window_size = 100
+        error = setpoint - ispoint
+
+        inside = np.abs(error) <= config.pid_control_window
+        if timeDelta > 0:
+            self.iterm += np.where(inside, error * timeDelta * (1 / self.ki), 0)
+            dErr = (error - self.lastErr) / timeDelta
+        else:
+            dErr = 0
+        output = self.kp * error + self.iterm + self.kd * dErr
+        output = np.clip(output, -1 * window_size, window_size) / window_size
+
+        # outside the window it's a binary on/off switch
+        output = np.where(error > config.pid_control_window, 1.0, output)
+        output = np.where(error < (-1 * config.pid_control_window), 0.0, output)
+        self.lastErr = error
+
+        # no active cooling
+        return np.maximum(output, 0)
+
+
+class BatchSimulation(object):
+    '''fire n simulated ovens through their profiles in lock-step.
+
+    profiles is one Profile per oven. kp/ki/kd, startat and the plant
+    parameters (t_env, c_heat, c_oven, p_heat, R_o_nocool, R_ho_noair) are
+    scalars or arrays with one entry per oven, defaulting to config.
+    '''
+    def __init__(self, profiles, kp=None, ki=None, kd=None, startat=0,
+                 time_step=None, **plant):
+        self.profiles = list(profiles)
+        self.n = len(self.profiles)
+        self.time_step = config.sensor_time_wait if time_step is None else time_step
+        self.startat = lanes(startat, self.n)
+        self.plant = BatchPlant(self.n, time_step=self.time_step, **plant)
+        self.pid = BatchPID(self.n, kp=kp, ki=ki, kd=kd)
+
+        # lanes sharing a profile are looked up together
+        self.groups = {}
+        for i, profile in enumerate(self.profiles):
+            self.groups.setdefault(id(profile), (profile, []))[1].append(i)
+        self.groups = [(profile, np.array(idx)) for (profile, idx) in self.groups.values()]
+        self.totaltime = np.zeros(self.n)
+        for profile, idx in self.groups:
+            self.totaltime[idx] = profile.get_duration()
+
+    def get_target_temperatures(self, runtime):
+        target = np.zeros(self.n)
+        for profile, idx in self.groups:
+            target[idx] = profile.get_target_temperatures(runtime[idx])
+        return target
+
+    def run(self, max_time=None, record=False):
+        '''fire every oven until its schedule ends, it hits an emergency or
+        max_time seconds pass (default three times the longest schedule).
+
+        returns a dict of arrays, one entry per oven:
+            cost       - as Oven.update_cost would have added it up
+            energy     - kWh used
+            iae        - integrated absolute error, degree seconds
+            overshoot  - largest amount the kiln was over target
+            behind     - seconds the schedule was held by kiln_must_catch_up
+            elapsed    - seconds of firing
+            emergency  - True if the kiln got too hot
+            completed  - True if the schedule ran to the end
+        with record=True it also has temperature, target, heat and runtime
+        arrays of shape (ticks, n).
+        '''
+        n = self.n
+        dt = self.time_step
+        if max_time is None:
+            max_time = 3 * self.totaltime.max()
+        offset = config.thermocouple_offset
+        window = config.pid_control_window
+
+        runtime = self.startat.copy()
+        target = np.zeros(n)
+        heat = np.zeros(n)
+        running = np.ones(n, dtype=bool)
+
+        energy = np.zeros(n)
+        iae = np.zeros(n)
+        overshoot = np.zeros(n)
+        behind = np.zeros(n)
+        elapsed = np.zeros(n)
+        emergency = np.zeros(n, dtype=bool)
+        completed = np.zeros(n, dtype=bool)
+        trace = {'temperature': [], 'target': [], 'heat': [], 'runtime': []}
+
+        ticks = int(max_time / dt) + 1
+        for tick in range(ticks):
+            # update_cost uses the heat from the last tick
+            energy += np.where(running, config.kw_elements * (heat / 3600), 0)
+
+            temp = self.plant.t + offset
+            # kiln_must_catch_up holds the schedule, update_runtime
+            # moves it on by the time that passed in the last sleep
+            if config.kiln_must_catch_up:
+                held = np.abs(target - temp) > window
+            else:
+                held = np.zeros(n, dtype=bool)
+            if tick > 0:
+                runtime = np.where(running & ~held, runtime + dt, runtime)
+                behind += np.where(running & held, dt, 0)
+                elapsed += np.where(running, dt, 0)
+
+            target = self.get_target_temperatures(runtime)
+            pid = self.pid.compute(target, temp, dt if tick > 0 else 0)
+            pid = np.where(running, pid, 0)
+            self.plant.step(pid)
+            heat = np.where(pid > 0, dt * pid, 0)
+
+            in_schedule = running & (runtime <= self.totaltime)
+            iae += np.where(in_schedule, np.abs(target - temp) * dt, 0)
+            overshoot = np.where(in_schedule, np.maximum(overshoot, temp - target), overshoot)
+
+            if record:
+                trace['temperature'].append(temp)
+                trace['target'].append(target)
+                trace['heat'].append(heat)
+                trace['runtime'].append(runtime)
+
+            # reset_if_emergency and reset_if_schedule_ended
+            too_hot = (self.plant.t + offset) >= config.emergency_shutoff_temp
+            if config.ignore_temp_too_high:
+                too_hot[:] = False
+            ended = runtime > self.totaltime
+            emergency |= running & too_hot
+            completed |= running & ended & ~too_hot
+            running &= ~(too_hot | ended)
+            if not running.any():
+                break
+
+        log.info("batch of %d ovens fired in %d ticks, %d still running" %
+            (n, tick + 1, running.sum()))
+
+        results = {
+            'cost': energy * config.kwh_rate,
+            'energy': energy,
+            'iae': iae,
+            'overshoot': overshoot,
+            'behind': behind,
+            'elapsed': elapsed,
+            'emergency': emergency,
+            'completed': completed,
+        }
+        if record:
+            for k, v in trace.items():
+                results[k] = np.array(v)
+        return results
@@ -155,11 +155,11 @@ class OvenDisplay(threading.Thread):
     def nextDisplayHandler(self):
         self.currentDisplayHandlerIdx = (self.currentDisplayHandlerIdx+1) % len(self.displayHandlers)
 
-    def update_profiles(self, new_profiles):
-        log.info("New profiles ")
-        log.info(new_profiles)
+    def update_profiles(self, changes):
+        # changes is a ProfileRepository.changes() dict
+        log.info("Profiles: %d changed, %d deleted" % (len(changes['profiles']), len(changes['deleted'])))
         for idx, dh in enumerate(self.displayHandlers):
-            dh.update_profiles(new_profiles)
+            dh.update_profiles(changes)
 
     def send(self,oven_state_json):
         oven_state = json.loads(oven_state_json)
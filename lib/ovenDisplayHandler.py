@@ -42,8 +42,20 @@ class OvenDisplayHandler:
     def render(self, data):
         pass
 
-    def update_profiles(self, new_profiles):
-        self.profiles = new_profiles
+    def update_profiles(self, changes):
+        # apply a ProfileRepository.changes() dict, changed profiles are
+        # replaced where they were and new ones go on the end
+        if changes['full'] or self.profiles is None:
+            self.profiles = list(changes['profiles'])
+            return
+        changed = dict((p.get('name'), p) for p in changes['profiles'])
+        profiles = []
+        for p in self.profiles:
+            name = p.get('name')
+            if name in changes['deleted']:
+                continue
+            profiles.append(changed.pop(name, p))
+        self.profiles = profiles + [p for p in changes['profiles'] if p.get('name') in changed]
 
     def setLedFromOvenState(self, oven_state):
         if ((oven_state['state'] is None) or (oven_state['state'] == 'IDLE')):
@@ -1,7 +1,7 @@
 import logging
 import json
 from ovenDisplayHandler import OvenDisplayHandler
-from oven import Oven, Profile
+from oven import Oven, Profile, ProfileError
 import config
 
 log = logging.getLogger(__name__)
@@ -92,20 +92,22 @@ class OvenEditDisplayHandler(OvenDisplayHandler):
             currentTemp = self.ovenState['temperature']
 
         name = "{0:2.0f}C {1:2.0f}C/h {2:2.0f}m soak".format(self.target, self.ramp, self.soak)
-        p0 = [0, currentTemp]
-        time1 = (self.rampTarget - currentTemp) * 3600 / self.ramp
-        p1 = [time1, self.rampTarget]
-        time2 = time1 + (self.target - self.rampTarget) * 3600 / self.maxRamp
-        p2 = [time2, self.target]
-        time3 = time2 + self.soak * 60
-        p3 = [time3, self.target]
-        data = [p0, p1, p2, p3]
+        segments = []
+        if (currentTemp < self.rampTarget):
+            segments.append({'rate': self.ramp, 'target': self.rampTarget})
+        segments.append({'rate': self.maxRamp, 'target': self.target})
+        segments.append({'hold': self.soak})
         profileData = {
             'type': 'profile',
-            'data': data,
+            'start': currentTemp,
+            'segments': segments,
             'name': name
         }
         jsonProfile = json.dumps(profileData)
         log.info(jsonProfile)
-        profile = Profile(jsonProfile)
+        try:
+            profile = Profile(jsonProfile)
+        except ProfileError as e:
+            log.error("Could not build profile: %s" % e)
+            return
         self.ovenDisplay.runProfile(profile)
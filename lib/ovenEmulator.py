@@ -0,0 +1,381 @@
+import logging
+import threading
+import time
+import config
+from oven import RealOven, Board, Output
+from max31855 import MAX31855
+from max31855spi import MAX31855SPI, time_reads
+from max31856 import MAX31856
+
+log = logging.getLogger(__name__)
+
+# A kiln with no hardware, for running the real control code on any
+# machine. The MAX31855 and MAX31856 are emulated down to their SPI
+# frames and registers and the heater relay is an emulated GPIO pin, so
+# RealOven, TempSensorReal and the thermocouple drivers all run as they
+# do on a Pi. The temperature comes from the same thermal equations as
+# SimulatedOven, integrated between heater pin changes. Faults can be
+# injected into the emulated boards to exercise the emergency handling.
+#
+#   kiln = EmulatedKiln()
+#   kiln.oven                     a started RealOven
+#   kiln.device.inject('open')    the thermocouple comes loose
+#   kiln.device.clear()
+#
+# The faults each board can report are the keys of its FAULT_BITS. The
+# MAX31855 tells a short to ground from a short to VCC, the MAX31856 has
+# a single over/under voltage bit for both.
+
+
+def to_celsius(temp):
+    '''the boards always talk in celsius, config temperatures are in
+       temp_scale'''
+    if config.temp_scale.lower() == "f":
+        return (temp - 32) * 5.0 / 9.0
+    return temp
+
+
+class ThermalModel(object):
+    '''
+    the heating element and kiln of SimulatedOven, heated at full power
+    while the heater is on. the temperature is worked forward to the time
+    it is asked for, in steps of at most max_step seconds. speedup makes
+    the kiln heat and cool that many times faster than real time.
+    '''
+    max_step = 1.0
+
+    def __init__(self, speedup=1, monotonic=time.monotonic):
+        self.speedup = float(speedup)
+        self.monotonic = monotonic
+        self.lock = threading.Lock()
+        self.t_env = config.sim_t_env
+        self.c_heat = config.sim_c_heat
+        self.c_oven = config.sim_c_oven
+        self.p_heat = config.sim_p_heat
+        self.R_o = config.sim_R_o_nocool
+        self.R_ho = config.sim_R_ho_noair
+        self.t = self.t_env
+        self.t_h = self.t_env
+        self.heating = False
+        self.last = self.monotonic()
+
+    def step(self, dt, duty):
+        '''the same equations as SimulatedOven.temp_changes'''
+        self.t_h += self.p_heat * dt * duty / self.c_heat
+        p_ho = (self.t_h - self.t) / self.R_ho
+        self.t += p_ho * dt / self.c_oven
+        self.t_h -= p_ho * dt / self.c_heat
+        p_env = (self.t - self.t_env) / self.R_o
+        self.t -= p_env * dt / self.c_oven
+
+    def advance(self):
+        now = self.monotonic()
+        elapsed = (now - self.last) * self.speedup
+        self.last = now
+        duty = 1.0 if self.heating else 0.0
+        while elapsed > 0:
+            dt = min(elapsed, self.max_step)
+            self.step(dt, duty)
+            elapsed -= dt
+
+    def set_heat(self, on):
+        with self.lock:
+            self.advance()
+            self.heating = on
+
+    def temperature(self):
+        '''kiln temperature now, in temp_scale'''
+        with self.lock:
+            self.advance()
+            return self.t
+
+
+class EmulatedGPIO(object):
+    '''
+    enough of the RPi.GPIO interface for Output and the bitbanged
+    MAX31855. devices listen to pins with on_output and drive inputs
+    with on_input.
+    '''
+    BCM = 11
+    BOARD = 10
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+
+    def __init__(self):
+        self.mode = None
+        self.pins = {}
+        self.outputs = {}
+        self.inputs = {}
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, pin, direction):
+        self.pins[pin] = direction
+
+    def on_output(self, pin, callback):
+        '''callback(value) whenever pin is written'''
+        self.outputs[pin] = callback
+
+    def on_input(self, pin, callback):
+        '''callback() gives the level read from pin'''
+        self.inputs[pin] = callback
+
+    def output(self, pin, value):
+        callback = self.outputs.get(pin)
+        if callback:
+            callback(value)
+
+    def input(self, pin):
+        callback = self.inputs.get(pin)
+        return callback() if callback else self.LOW
+
+    def cleanup(self):
+        self.pins.clear()
+
+
+class EmulatedThermocouple(object):
+    '''common to both boards: the model it measures, injected faults and
+       the no-op SPI settings of the Adafruit_GPIO.SPI interface'''
+    # fault name: the bits the board sets for it
+    FAULT_BITS = {}
+
+    def __init__(self, model, cold_junction=25.0):
+        self.model = model
+        self.cold_junction = cold_junction
+        self.fault = None
+        self.fault_reads = None
+        self.reads = 0
+
+    def inject(self, fault, reads=None):
+        '''report fault, one of FAULT_BITS, for the next reads conversions
+           or until clear() if reads is None'''
+        if fault not in self.FAULT_BITS:
+            raise ValueError("unknown fault %r, use one of %s" % (fault, ", ".join(self.FAULT_BITS)))
+        self.fault = fault
+        self.fault_reads = reads
+
+    def clear(self):
+        self.fault = None
+        self.fault_reads = None
+
+    def conversion(self):
+        '''(thermocouple celsius, cold junction celsius, fault) for one read'''
+        self.reads += 1
+        fault = self.fault
+        if self.fault_reads is not None:
+            self.fault_reads -= 1
+            if self.fault_reads <= 0:
+                self.clear()
+        return to_celsius(self.model.temperature()), self.cold_junction, fault
+
+    def set_clock_hz(self, hz):
+        pass
+
+    def set_mode(self, mode):
+        pass
+
+    def set_bit_order(self, order):
+        pass
+
+    def close(self):
+        pass
+
+
+class EmulatedMAX31855(EmulatedThermocouple):
+    '''
+    a MAX31855 read either through EmulatedGPIO pins, as the bitbang
+    driver does, or as the SPI device of MAX31855SPI. the thermocouple
+    value in the frame is chosen so the driver's NIST linearization gives
+    back the model temperature.
+    '''
+    FAULT_BITS = {'open': 0x1, 'short_gnd': 0x2, 'short_vcc': 0x4}
+
+    def __init__(self, model, gpio=None, cs_pin=None, clock_pin=None, data_pin=None, cold_junction=25.0):
+        EmulatedThermocouple.__init__(self, model, cold_junction)
+        self.decoder = MAX31855.__new__(MAX31855)
+        self.codes = {}
+        self.shift = 0
+        self.bit = 0
+        if gpio is not None:
+            self.gpio = gpio
+            self.clock = gpio.LOW
+            gpio.on_output(cs_pin, self.chip_select)
+            gpio.on_output(clock_pin, self.clock_edge)
+            gpio.on_input(data_pin, self.data_out)
+
+    def decode(self, frame):
+        self.decoder.data = frame
+        return self.decoder.data_to_LinearizedTempC()
+
+    def tc_code(self, celsius, rj_code):
+        '''the 14 bit thermocouple value that linearizes closest to celsius,
+           by bisection as the linearization only goes one way'''
+        key = (round(celsius, 2), rj_code)
+        if key in self.codes:
+            return self.codes[key]
+        # -270C to 1372C, the range of a type K thermocouple
+        lo = -1080
+        hi = 5488
+        rj = rj_code << 4
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if self.decode(((mid & 0x3fff) << 18) | rj) < celsius:
+                lo = mid
+            else:
+                hi = mid
+        if abs(self.decode(((lo & 0x3fff) << 18) | rj) - celsius) <= \
+           abs(self.decode(((hi & 0x3fff) << 18) | rj) - celsius):
+            hi = lo
+        if len(self.codes) > 10000:
+            self.codes.clear()
+        self.codes[key] = hi
+        return hi
+
+    def frame(self):
+        celsius, cold_junction, fault = self.conversion()
+        rj_code = int(round(cold_junction / 0.0625)) & 0xfff
+        if fault:
+            return (rj_code << 4) | 0x10000 | self.FAULT_BITS[fault]
+        tc_code = self.tc_code(celsius, rj_code)
+        return ((tc_code & 0x3fff) << 18) | (rj_code << 4)
+
+    # Adafruit_GPIO.SPI, for MAX31855SPI
+    def read(self, length):
+        return bytearray(self.frame().to_bytes(4, 'big')[:length])
+
+    # pins, for the bitbang MAX31855
+    def chip_select(self, value):
+        if value == self.gpio.LOW:
+            self.shift = self.frame()
+            self.bit = 31
+
+    def clock_edge(self, value):
+        # the driver reads each bit with the clock low and raises it after
+        if value == self.gpio.HIGH and self.clock == self.gpio.LOW:
+            self.bit -= 1
+        self.clock = value
+
+    def data_out(self):
+        if self.bit < 0:
+            return self.gpio.LOW
+        return (self.shift >> self.bit) & 1
+
+
+class EmulatedMAX31856(EmulatedThermocouple):
+    '''
+    the register map of a MAX31856 behind the Adafruit_GPIO.SPI transfer
+    interface. reads and writes auto increment through the registers as
+    the chip does, and the temperature and fault registers hold a fresh
+    conversion whenever a transfer starts. a short to either rail sets
+    the same over/under voltage bit, so there is one 'short' fault.
+    '''
+    REGISTERS = 16
+    FAULT_BITS = {'open': 0x01, 'short': 0x02}
+
+    def __init__(self, model, cold_junction=25.0):
+        EmulatedThermocouple.__init__(self, model, cold_junction)
+        self.registers = bytearray(self.REGISTERS)
+        self.transfers = 0
+
+    def convert(self):
+        celsius, cold_junction, fault = self.conversion()
+        cj = int(round(cold_junction / MAX31856.MAX31856_CONST_CJ_LSB)) & 0x3fff
+        tc = int(round(celsius / MAX31856.MAX31856_CONST_THERM_LSB)) & 0x7ffff
+        r = self.registers
+        r[MAX31856.MAX31856_REG_READ_CJTH] = cj >> 6
+        r[MAX31856.MAX31856_REG_READ_CJTL] = (cj << 2) & 0xff
+        r[MAX31856.MAX31856_REG_READ_LTCBH] = tc >> 11
+        r[MAX31856.MAX31856_REG_READ_LTCBM] = (tc >> 3) & 0xff
+        r[MAX31856.MAX31856_REG_READ_LTCBL] = (tc << 5) & 0xff
+        r[MAX31856.MAX31856_REG_READ_FAULT] = self.FAULT_BITS[fault] if fault else 0
+
+    def transfer(self, data):
+        self.transfers += 1
+        address = data[0]
+        out = [0]
+        if address & 0x80:
+            for i, value in enumerate(data[1:]):
+                self.registers[((address & 0x7f) + i) % self.REGISTERS] = value
+            return bytearray(out + [0] * (len(data) - 1))
+        self.convert()
+        for i in range(len(data) - 1):
+            out.append(self.registers[(address + i) % self.REGISTERS])
+        return bytearray(out)
+
+
+class EmulatedKiln(object):
+    '''
+    a started RealOven wired to an emulated thermocouple board and heater
+    relay. chip is 'max31855' or 'max31856', by default whichever config
+    selects, and config.gpio_spi picks bitbang or hardware SPI for the
+    MAX31855.
+    '''
+    def __init__(self, chip=None, speedup=1):
+        if chip is None:
+            chip = 'max31855' if config.max31855 else 'max31856'
+        self.model = ThermalModel(speedup)
+        self.gpio = EmulatedGPIO()
+        # the relay is on while the heat pin is low, see Output.heat
+        self.gpio.on_output(config.gpio_heat,
+            lambda value: self.model.set_heat(value == self.gpio.LOW))
+
+        if chip == 'max31855':
+            if config.gpio_spi:
+                self.device = EmulatedMAX31855(self.model, self.gpio, config.gpio_sensor_cs,
+                    config.gpio_sensor_clock, config.gpio_sensor_data)
+                self.thermocouple = MAX31855(config.gpio_sensor_cs, config.gpio_sensor_clock,
+                    config.gpio_sensor_data, config.temp_scale, gpio=self.gpio)
+            else:
+                self.device = EmulatedMAX31855(self.model)
+                self.thermocouple = MAX31855SPI(units=config.temp_scale, spi=self.device)
+        elif chip == 'max31856':
+            self.device = EmulatedMAX31856(self.model)
+            self.thermocouple = MAX31856(tc_type=config.thermocouple_type,
+                                         units=config.temp_scale,
+                                         ac_freq_50hz=config.ac_freq_50hz,
+                                         avgsel=config.max31856_avgsel,
+                                         spi=self.device)
+        else:
+            raise ValueError("unknown thermocouple board %r" % (chip,))
+
+        log.info("emulating a %s kiln, %dx real time" % (chip, speedup))
+        self.oven = RealOven(board=Board(thermocouple=self.thermocouple),
+                             output=Output(gpio=self.gpio))
+
+
+if __name__ == "__main__":
+
+    # Time the thermocouple drivers against the emulated boards, then
+    # check a fault injected into each board reaches the driver flags.
+    model = ThermalModel()
+    gpio = EmulatedGPIO()
+    drivers = [
+        ("max31855 bitbang", EmulatedMAX31855(model, gpio, 1, 2, 3),
+         lambda device: MAX31855(1, 2, 3, gpio=gpio)),
+        ("max31855 spidev", EmulatedMAX31855(model),
+         lambda device: MAX31855SPI(spi=device)),
+        ("max31856", EmulatedMAX31856(model),
+         lambda device: MAX31856(tc_type=MAX31856.MAX31856_K_TYPE, spi=device)),
+    ]
+    print("{:18} {:>8} {:>10} {:>10} {:>10}   {}".format(
+        "driver", "temp", "mean us", "median us", "p99 us", "faults seen"))
+    for name, device, make in drivers:
+        thermocouple = make(device)
+        times = time_reads(thermocouple, 2000)
+        temp = thermocouple.get()
+        seen = []
+        for fault in device.FAULT_BITS:
+            device.inject(fault, reads=1)
+            thermocouple.get()
+            flags = [flag for flag in ('noConnection', 'shortToGround', 'shortToVCC', 'unknownError')
+                     if getattr(thermocouple, flag)]
+            seen.append("%s:%s" % (fault, ",".join(flags)))
+        print("{:18} {:8.2f} {:10.1f} {:10.1f} {:10.1f}   {}".format(
+            name, temp, sum(times) / len(times), times[len(times) // 2],
+            times[int(len(times) * 0.99)], " ".join(seen)))
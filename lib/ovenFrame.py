@@ -0,0 +1,156 @@
+import math
+import struct
+from sensorFaults import FAULT_TYPES
+
+# Fixed layout binary frames of Oven.get_state(), sent on
+# /status?encoding=binary. All numbers are little endian.
+#
+#   header   magic "KF", version (B), flags (B), seq (I)
+#   state    cost, runtime, temperature, target, heat, totaltime,
+#            kwh_rate as doubles, then the state as a byte
+#   pidstats time, timeDelta, setpoint, ispoint, err, errDelta, p, i, d,
+#            kp, ki, kd, pid, out as doubles, only if flags has PIDSTATS
+#   faults   window, percent, last_fault as doubles, readings, bad, then
+#            the counts and totals of each of sensorFaults.FAULT_TYPES as
+#            I, only if flags has FAULTS
+#   sampling period as a double, ticks, overruns, skipped as I, only if
+#            flags has SAMPLING
+#   strings  profile, status, currency_type, the pidstats status and the
+#            faults last_kinds joined with commas, each a H length then
+#            utf-8, an empty profile meaning None
+#
+# A number that is missing or None is sent as NaN and read back as None.
+# This module only imports sensorFaults, which needs nothing but the
+# standard library, so kiln-logger.py can use it alone.
+
+MAGIC = b'KF'
+VERSION = 2
+PIDSTATS = 0x01
+FAULTS = 0x02
+SAMPLING = 0x04
+
+STATE_FIELDS = ('cost', 'runtime', 'temperature', 'target', 'heat',
+                'totaltime', 'kwh_rate')
+PID_FIELDS = ('time', 'timeDelta', 'setpoint', 'ispoint', 'err', 'errDelta',
+              'p', 'i', 'd', 'kp', 'ki', 'kd', 'pid', 'out')
+FAULT_FIELDS = ('window', 'percent', 'last_fault')
+FAULT_COUNTS = ('readings', 'bad')
+SAMPLING_COUNTS = ('ticks', 'overruns', 'skipped')
+STRING_FIELDS = ('profile', 'status', 'currency_type', 'pid_status', 'fault_kinds')
+STATES = ('IDLE', 'RUNNING')
+UNKNOWN_STATE = 255
+
+header = struct.Struct('<2sBBI')
+state_part = struct.Struct('<%ddB' % len(STATE_FIELDS))
+pid_part = struct.Struct('<%dd' % len(PID_FIELDS))
+sampling_part = struct.Struct('<d%dI' % len(SAMPLING_COUNTS))
+fault_part = struct.Struct('<%dd%dI' % (len(FAULT_FIELDS),
+                           len(FAULT_COUNTS) + 2 * len(FAULT_TYPES)))
+string_length = struct.Struct('<H')
+
+
+class FrameError(Exception):
+     def __init__(self, value):
+         self.value = value
+     def __str__(self):
+         return repr(self.value)
+
+
+def number(value):
+    if value is None or isinstance(value, bool) or not isinstance(value, (int, float)):
+        return math.nan
+    return value
+
+def count(value):
+    if isinstance(value, bool) or not isinstance(value, int):
+        return 0
+    return min(max(value, 0), 0xffffffff)
+
+def pack(state, seq=0):
+    '''one frame holding state, a dict like Oven.get_state()'''
+    pidstats = state.get('pidstats') or {}
+    faults = state.get('faults') or {}
+    sampling = state.get('sampling') or {}
+    flags = (PIDSTATS if pidstats else 0) | (FAULTS if faults else 0) | \
+            (SAMPLING if sampling else 0)
+    if state.get('state') in STATES:
+        code = STATES.index(state.get('state'))
+    else:
+        code = UNKNOWN_STATE
+
+    parts = [header.pack(MAGIC, VERSION, flags, seq & 0xffffffff),
+             state_part.pack(*([number(state.get(f)) for f in STATE_FIELDS] + [code]))]
+    if pidstats:
+        parts.append(pid_part.pack(*[number(pidstats.get(f)) for f in PID_FIELDS]))
+    if faults:
+        counts = faults.get('counts') or {}
+        totals = faults.get('totals') or {}
+        parts.append(fault_part.pack(*(
+            [number(faults.get(f)) for f in FAULT_FIELDS] +
+            [count(faults.get(f)) for f in FAULT_COUNTS] +
+            [count(counts.get(kind)) for kind in FAULT_TYPES] +
+            [count(totals.get(kind)) for kind in FAULT_TYPES])))
+    if sampling:
+        parts.append(sampling_part.pack(number(sampling.get('period')),
+            *[count(sampling.get(f)) for f in SAMPLING_COUNTS]))
+    strings = dict(state)
+    strings['pid_status'] = pidstats.get('status')
+    strings['fault_kinds'] = ','.join(faults.get('last_kinds') or [])
+    for field in STRING_FIELDS:
+        text = (strings.get(field) or '').encode('utf-8')[:0xffff]
+        parts.append(string_length.pack(len(text)))
+        parts.append(text)
+    return b''.join(parts)
+
+def unpack(frame):
+    '''the state dict in a frame, with its seq added'''
+    try:
+        (magic, version, flags, seq) = header.unpack_from(frame, 0)
+        if magic != MAGIC or version != VERSION:
+            raise FrameError("not a version %d frame" % VERSION)
+        offset = header.size
+        values = state_part.unpack_from(frame, offset)
+        offset += state_part.size
+        state = dict(zip(STATE_FIELDS, values))
+        code = values[-1]
+        state['state'] = STATES[code] if code < len(STATES) else None
+        state['pidstats'] = {}
+        if flags & PIDSTATS:
+            state['pidstats'] = dict(zip(PID_FIELDS, pid_part.unpack_from(frame, offset)))
+            offset += pid_part.size
+        faults = None
+        if flags & FAULTS:
+            values = fault_part.unpack_from(frame, offset)
+            offset += fault_part.size
+            n = len(FAULT_FIELDS) + len(FAULT_COUNTS)
+            faults = dict(zip(FAULT_FIELDS + FAULT_COUNTS, values[:n]))
+            faults['counts'] = dict(zip(FAULT_TYPES, values[n:n + len(FAULT_TYPES)]))
+            faults['totals'] = dict(zip(FAULT_TYPES, values[n + len(FAULT_TYPES):]))
+        state['sampling'] = None
+        if flags & SAMPLING:
+            values = sampling_part.unpack_from(frame, offset)
+            offset += sampling_part.size
+            state['sampling'] = dict(zip(('period',) + SAMPLING_COUNTS, values))
+        for field in STRING_FIELDS:
+            (length,) = string_length.unpack_from(frame, offset)
+            offset += string_length.size
+            state[field] = bytes(frame[offset:offset + length]).decode('utf-8')
+            offset += length
+    except (struct.error, UnicodeDecodeError) as e:
+        raise FrameError("bad frame: %s" % e)
+
+    # get_state has no profile when idle
+    state['profile'] = state['profile'] or None
+    pid_status = state.pop('pid_status')
+    if flags & PIDSTATS:
+        state['pidstats']['status'] = pid_status
+    fault_kinds = state.pop('fault_kinds')
+    if faults is not None:
+        faults['last_kinds'] = fault_kinds.split(',') if fault_kinds else []
+        state['faults'] = faults
+    for d in (state, state['pidstats'], faults or {}, state['sampling'] or {}):
+        for k, v in d.items():
+            if isinstance(v, float) and math.isnan(v):
+                d[k] = None
+    state['seq'] = seq
+    return state
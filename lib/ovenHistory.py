@@ -0,0 +1,176 @@
+import logging
+
+log = logging.getLogger(__name__)
+
+# A fixed memory record of a firing, for drawing the whole of it without
+# losing its peaks. Samples are kept in min/max buckets that merge and
+# double in width as the firing goes on, so a firing of any length costs
+# the same memory and the same time to draw. With the default 256 buckets
+# that is at most 512 buckets of two samples, about 200KB for a 30 hour
+# firing or a week long one. Recent samples are not kept at full
+# resolution, the recorder's sqlite history has every sample of every
+# firing for that.
+
+FIELDS = ('runtime', 'temperature', 'target', 'heat', 'cost')
+
+
+def downsample(rows, maxpts, key):
+    '''
+    cut rows down to at most maxpts while keeping their shape. the rows
+    are split into equal buckets and from each the rows with the lowest
+    and highest key(row) are kept, in their original order, so spikes and
+    dips are never skipped over. the first and last rows are always kept
+    while there is room, the last alone if maxpts is 1.
+    '''
+    n = len(rows)
+    if n <= maxpts:
+        return list(rows)
+    if maxpts < 1:
+        return []
+    if maxpts == 1:
+        return [rows[-1]]
+    if maxpts < 4:
+        return [rows[0], rows[-1]]
+    buckets = (maxpts - 2) // 2
+    out = [rows[0]]
+    for b in range(buckets):
+        lo = 1 + b * (n - 2) // buckets
+        hi = 1 + (b + 1) * (n - 2) // buckets
+        if lo >= hi:
+            continue
+        low = high = lo
+        for i in range(lo + 1, hi):
+            if key(rows[i]) < key(rows[low]):
+                low = i
+            if key(rows[i]) > key(rows[high]):
+                high = i
+        for i in sorted(set((low, high))):
+            out.append(rows[i])
+    out.append(rows[-1])
+    return out
+
+
+class Downsampler(object):
+    '''
+    min/max per bucket downsampling done as rows arrive. each bucket keeps
+    the rows with the lowest and highest value of field. buckets cover
+    width rows, and when there are 2 * buckets of them neighbours are
+    merged and width doubles, so memory and the cost of points() stay
+    fixed however many rows are added.
+    '''
+    def __init__(self, fields=FIELDS, field='temperature', buckets=256):
+        self.fields = tuple(fields)
+        self.index = self.fields.index(field)
+        self.buckets = buckets
+        self.clear()
+
+    def clear(self):
+        self.width = 1
+        self.closed = []
+        self.open = None
+        self.first = None
+        self.last = None
+
+    def add(self, row):
+        '''row is a tuple of values in fields order'''
+        if self.first is None:
+            self.first = row
+        self.last = row
+        if self.open is None:
+            self.open = [1, row, row]
+        else:
+            self.open = self.merge(self.open, [1, row, row])
+        if self.open[0] >= self.width:
+            self.closed.append(self.open)
+            self.open = None
+            if len(self.closed) >= 2 * self.buckets:
+                self.closed = [self.merge(self.closed[i], self.closed[i + 1])
+                               for i in range(0, len(self.closed), 2)]
+                self.width *= 2
+
+    def merge(self, a, b):
+        k = self.index
+        low = a[1] if a[1][k] <= b[1][k] else b[1]
+        high = a[2] if a[2][k] >= b[2][k] else b[2]
+        return [a[0] + b[0], low, high]
+
+    def points(self, maxpts=50):
+        '''at most maxpts rows as dicts, the first and last included
+        whenever maxpts is at least 2'''
+        if self.first is None:
+            return []
+        buckets = list(self.closed)
+        if self.open is not None:
+            buckets.append(self.open)
+        # merge neighbours again until two rows a bucket fit in maxpts
+        budget = max(1, (maxpts - 2) // 2)
+        if len(buckets) > budget:
+            group = -(-len(buckets) // budget)
+            merged = []
+            for i in range(0, len(buckets), group):
+                bucket = buckets[i]
+                for other in buckets[i + 1:i + group]:
+                    bucket = self.merge(bucket, other)
+                merged.append(bucket)
+            buckets = merged
+
+        rows = [self.first]
+        for (count, low, high) in buckets:
+            for row in sorted(set((low, high)), key=lambda r: r[0]):
+                if row is not rows[-1] and row != rows[-1]:
+                    rows.append(row)
+        if rows[-1] != self.last:
+            rows.append(self.last)
+        if len(rows) > maxpts:
+            rows = self.thin(rows, maxpts)
+        return [dict(zip(self.fields, row)) for row in rows]
+
+    def thin(self, rows, maxpts):
+        '''maxpts of rows evenly spread, the first and last always kept
+        while there is room, the last alone if maxpts is 1'''
+        if maxpts < 1:
+            return []
+        if maxpts == 1:
+            return [rows[-1]]
+        middle = rows[1:-1]
+        keep = maxpts - 2
+        picked = [middle[(i * len(middle)) // keep] for i in range(keep)]
+        return [rows[0]] + picked + [rows[-1]]
+
+
+class OvenHistory(object):
+    '''
+    the states of one firing in fixed memory. append an Oven.get_state()
+    every time_step, ask for subset(maxpts) to draw it.
+
+    fields    - the state keys kept, missing or non numeric values are 0
+    buckets   - how many min/max buckets to keep
+    '''
+    def __init__(self, fields=FIELDS, buckets=256):
+        self.fields = tuple(fields)
+        self.shape = Downsampler(self.fields, buckets=buckets)
+        self.count = 0
+
+    def clear(self):
+        self.shape.clear()
+        self.count = 0
+
+    def __len__(self):
+        '''samples appended since the last clear'''
+        return self.count
+
+    def append(self, state):
+        values = []
+        for field in self.fields:
+            value = state.get(field)
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                value = 0.0
+            values.append(float(value))
+        self.shape.add(tuple(values))
+        self.count += 1
+
+    def subset(self, maxpts=50):
+        '''at most maxpts samples of the whole firing as dicts keyed like
+        Oven.get_state(), keeping the highest and lowest temperatures so
+        overshoots show. costs the same however long the firing'''
+        return self.shape.points(maxpts)
@@ -0,0 +1,238 @@
+import collections
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from ovenHistory import FIELDS, downsample
+
+log = logging.getLogger(__name__)
+
+# Every firing is kept in an sqlite database. Samples are stored in a
+# table clustered on (firing, stamp), so any window of any firing is one
+# index range scan. The watcher hands samples to a FiringRecorder, which
+# only puts them on a queue; its own thread writes them in batches, so a
+# slow SD card never holds up the kiln. The database runs in WAL mode and
+# commits every batch, so a power cut loses at most the last batch.
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS firings (
+    id INTEGER PRIMARY KEY,
+    profile TEXT,
+    started REAL NOT NULL,
+    ended REAL,
+    state TEXT NOT NULL DEFAULT 'RUNNING',
+    samples INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS samples (
+    firing INTEGER NOT NULL,
+    stamp REAL NOT NULL,
+    %s,
+    PRIMARY KEY (firing, stamp)
+) WITHOUT ROWID;
+''' % ",\n    ".join("%s REAL" % field for field in FIELDS)
+
+FIRING_COLUMNS = ('id', 'profile', 'started', 'ended', 'state', 'samples')
+
+
+def connect(filename):
+    db = sqlite3.connect(filename, timeout=30)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    return db
+
+
+class FiringHistory(object):
+    '''read access to the recorded firings. every call opens its own
+    connection, so it can be used from any thread or greenlet'''
+    def __init__(self, filename, cache_size=64):
+        self.filename = filename
+        with connect(self.filename) as db:
+            db.executescript(SCHEMA)
+        self.cache = collections.OrderedDict()
+        self.cache_size = cache_size
+        self.cache_lock = threading.Lock()
+
+    def firings(self):
+        '''every recorded firing as a dict, newest first'''
+        db = connect(self.filename)
+        try:
+            rows = db.execute("SELECT %s FROM firings ORDER BY id DESC" %
+                ", ".join(FIRING_COLUMNS)).fetchall()
+        finally:
+            db.close()
+        return [dict(zip(FIRING_COLUMNS, row)) for row in rows]
+
+    def firing(self, firing):
+        '''one firing as a dict, or None'''
+        db = connect(self.filename)
+        try:
+            row = db.execute("SELECT %s FROM firings WHERE id = ?" %
+                ", ".join(FIRING_COLUMNS), (firing,)).fetchone()
+        finally:
+            db.close()
+        return dict(zip(FIRING_COLUMNS, row)) if row else None
+
+    def samples(self, firing, start=None, end=None):
+        '''the samples of a firing with start <= stamp <= end, as tuples
+        of stamp followed by FIELDS, oldest first'''
+        sql = "SELECT stamp, %s FROM samples WHERE firing = ?" % ", ".join(FIELDS)
+        args = [firing]
+        if start is not None:
+            sql += " AND stamp >= ?"
+            args.append(start)
+        if end is not None:
+            sql += " AND stamp <= ?"
+            args.append(end)
+        sql += " ORDER BY stamp"
+        db = connect(self.filename)
+        try:
+            return db.execute(sql, args).fetchall()
+        finally:
+            db.close()
+
+    def window(self, firing, start=None, end=None, points=500):
+        '''
+        at most points samples of a firing between start and end seconds
+        after it started, downsampled keeping the temperature peaks, as
+        dicts of stamp and FIELDS. None if there is no such firing.
+        answers are cached per (firing, start, end, points) until more
+        samples of the firing are written.
+        '''
+        info = self.firing(firing)
+        if info is None:
+            return None
+        key = (firing, start, end, points, info['samples'], info['ended'])
+        with self.cache_lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+
+        rows = self.samples(firing,
+            None if start is None else info['started'] + start,
+            None if end is None else info['started'] + end)
+        columns = ('stamp',) + FIELDS
+        index = columns.index('temperature')
+        rows = downsample(rows, points, key=lambda row: row[index])
+        result = [dict(zip(columns, row)) for row in rows]
+
+        with self.cache_lock:
+            self.cache[key] = result
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return result
+
+
+class FiringRecorder(threading.Thread):
+    '''
+    writes firings to a FiringHistory from its own thread. begin, sample
+    and finish never block. if the writer falls more than maxsize messages
+    behind new samples are dropped and counted, the start and end of a
+    firing are always kept. a batch that cannot be written is tried
+    retries times before it is given up.
+    '''
+    def __init__(self, history, maxsize=10000, batch=500, retries=3):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.history = history
+        self.queue = queue.Queue()
+        self.maxsize = maxsize
+        self.batch = batch
+        self.retries = retries
+        self.dropped = 0
+        self.written = 0
+        self.firing = None
+        self.uncounted = 0
+        self.start()
+
+    def put(self, message):
+        if message[0] == 'sample' and self.queue.qsize() >= self.maxsize:
+            if self.dropped == 0:
+                log.error("firing history writer is behind, dropping samples")
+            self.dropped += 1
+            return
+        self.queue.put(message)
+
+    def begin(self, profile, stamp):
+        '''a new firing of profile (a name) started at stamp'''
+        self.put(('begin', profile, stamp))
+
+    def sample(self, state, stamp):
+        '''one Oven.get_state() of the current firing'''
+        values = []
+        for field in FIELDS:
+            value = state.get(field)
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                value = None
+            values.append(value)
+        self.put(('sample', stamp, values))
+
+    def finish(self, state, stamp):
+        '''the current firing ended at stamp, state is COMPLETE or STOPPED'''
+        self.put(('finish', state, stamp))
+
+    def run(self):
+        db = connect(self.history.filename)
+        # firings still open from before a restart will never finish
+        with db:
+            db.execute("UPDATE firings SET state = 'INTERRUPTED' WHERE ended IS NULL")
+        while True:
+            messages = [self.queue.get()]
+            while len(messages) < self.batch:
+                try:
+                    messages.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self.store(db, messages)
+
+    def store(self, db, messages):
+        '''write one batch in one transaction, retrying it a few times. a
+        failed transaction is rolled back, so the firing being written and
+        the counts go back to what they were before it'''
+        (firing, written) = (self.firing, self.written)
+        for attempt in range(self.retries):
+            try:
+                with db:
+                    for message in messages:
+                        self.write(db, message)
+                    self.count(db)
+                return
+            except sqlite3.Error as e:
+                log.error("could not write firing history: %s" % e)
+                (self.firing, self.written, self.uncounted) = (firing, written, 0)
+                time.sleep(1)
+        lost = sum(1 for message in messages if message[0] == 'sample')
+        log.error("gave up writing firing history, %d samples lost" % lost)
+        # the firing the rest of the samples belong to may never have been
+        # written, drop them until the next one begins
+        if any(message[0] in ('begin', 'finish') for message in messages):
+            self.firing = None
+
+    def count(self, db):
+        # the sample count is kept up to date once a batch, not once a sample
+        if self.firing is not None and self.uncounted:
+            db.execute("UPDATE firings SET samples = samples + ? WHERE id = ?",
+                (self.uncounted, self.firing))
+        self.uncounted = 0
+
+    def write(self, db, message):
+        kind = message[0]
+        if kind in ('begin', 'finish'):
+            self.count(db)
+        if kind == 'begin':
+            (kind, profile, stamp) = message
+            self.firing = db.execute("INSERT INTO firings (profile, started) VALUES (?, ?)",
+                (profile, stamp)).lastrowid
+        elif self.firing is None:
+            return
+        elif kind == 'sample':
+            (kind, stamp, values) = message
+            db.execute("INSERT OR REPLACE INTO samples (firing, stamp, %s) VALUES (?, ?, %s)" %
+                (", ".join(FIELDS), ", ".join("?" * len(FIELDS))), [self.firing, stamp] + values)
+            self.uncounted += 1
+            self.written += 1
+        elif kind == 'finish':
+            (kind, state, stamp) = message
+            db.execute("UPDATE firings SET ended = ?, state = ? WHERE id = ?",
+                (stamp, state, self.firing))
+            self.firing = None
@@ -0,0 +1,200 @@
+import csv
+import logging
+import config
+from oven import Oven, TempSensor, VirtualClock, ProfileRepository
+
+log = logging.getLogger(__name__)
+
+# Replays a recorded firing through the real control code. The recorded
+# PID inputs (pid_ispoint, or the temperature in logs without pidstats)
+# are fed to Oven/PID through a fake sensor on a VirtualClock that moves
+# on by the recorded time between PID steps, so a whole firing replays
+# in a fraction of a second. The heat decisions made are compared
+# with the ones that were logged, to check control changes against real
+# firings without heating a kiln.
+
+class TempSensorReplay(TempSensor):
+    '''not a running thread, the replay sets the temperature each tick'''
+    def __init__(self):
+        TempSensor.__init__(self)
+
+class BoardReplay(object):
+    def __init__(self):
+        self.temp_sensor = TempSensorReplay()
+
+class ReplayOven(Oven):
+    '''an oven with no elements that makes the same decisions as a
+    RealOven, driven one step at a time'''
+    def __init__(self, clock):
+        self.clock = clock
+        self.quiet = True
+        self.board = BoardReplay()
+        super().__init__()
+        self.automatic_restarts = False
+
+    def heat_then_cool(self):
+        pid = self.pid.compute(self.target,
+                               self.board.temp_sensor.temperature +
+                               config.thermocouple_offset)
+        heat_on = float(self.time_step * pid)
+
+        # same as RealOven
+        self.heat = 0.0
+        if heat_on > 0:
+            self.heat = 1.0
+        self.clock.sleep(self.time_step)
+
+
+def read_log(filename):
+    '''
+    read a kiln-logger csv into a list of samples, one dict per row with
+    numbers converted to floats. rows without a time or temperature are
+    skipped.
+    '''
+    samples = []
+    with open(filename) as f:
+        for row in csv.DictReader(f):
+            sample = {}
+            for k, v in row.items():
+                try:
+                    sample[k] = float(v)
+                except (TypeError, ValueError):
+                    sample[k] = v
+            if 'stamp' not in sample and 'pid_time' in sample:
+                sample['stamp'] = sample['pid_time']
+            if not isinstance(sample.get('stamp'), float) or \
+               not isinstance(sample.get('temperature'), float):
+                continue
+            samples.append(sample)
+    return samples
+
+def load_profile(name, directory=None):
+    '''find a profile by name in the profiles directory, or None'''
+    directory = directory or config.kiln_profiles_directory
+    return ProfileRepository(directory).get_profile(name)
+
+def is_number(value):
+    return isinstance(value, float)
+
+def sensor_temperature(sample):
+    '''
+    what the sensor read for the PID step logged in sample. the logger
+    samples the watcher, not the oven step, so temperature can be a tick
+    off the reading the PID actually used, which pid_ispoint is
+    '''
+    if is_number(sample.get('pid_ispoint')):
+        return sample['pid_ispoint'] - config.thermocouple_offset
+    return sample['temperature'] - config.thermocouple_offset
+
+def time_steps(running):
+    '''
+    the seconds between each sample's PID step and the next. taken from
+    pid_timeDelta, the time the next PID step measured, or pid_time
+    differences when logged, the sample stamps otherwise
+    '''
+    steps = []
+    for sample, following in zip(running, running[1:]):
+        if is_number(following.get('pid_timeDelta')):
+            steps.append(following['pid_timeDelta'])
+        elif is_number(sample.get('pid_time')) and is_number(following.get('pid_time')):
+            steps.append(following['pid_time'] - sample['pid_time'])
+        else:
+            steps.append(following['stamp'] - sample['stamp'])
+    return steps
+
+def pid_steps(samples):
+    '''the RUNNING samples, one per PID step. the watcher can log the same
+    step twice, which shows as an unchanged pid_time and pid_timeDelta'''
+    running = []
+    for sample in samples:
+        if sample.get('state', 'RUNNING') != 'RUNNING':
+            continue
+        if running and is_number(sample.get('pid_time')) and \
+           sample.get('pid_time') == running[-1].get('pid_time') and \
+           sample.get('pid_timeDelta') == running[-1].get('pid_timeDelta'):
+            continue
+        running.append(sample)
+    return running
+
+def replay(samples, profile):
+    '''
+    replay the RUNNING part of samples (dicts with at least stamp and
+    temperature, and runtime, pid_time, pid_timeDelta, pid_ispoint,
+    pid_out, pid_i and pid_err when logged) against profile. yields
+    (sample, state) for every PID step, state being the replayed
+    Oven.get_state() to compare with the logged sample.
+    '''
+    running = pid_steps(samples)
+    if not running:
+        return
+    first = running[0]
+    start = first['pid_time'] if is_number(first.get('pid_time')) else first['stamp']
+    oven = ReplayOven(VirtualClock(start))
+    oven.run_profile(profile, startat=first.get('runtime', 0))
+
+    # a log that starts part way through a firing carries the pid
+    # history with it, so the replay does not start from scratch
+    if isinstance(first.get('pid_i'), float):
+        oven.pid.iterm = first['pid_i']
+    if isinstance(first.get('pid_err'), float):
+        oven.pid.lastErr = first['pid_err']
+
+    steps = time_steps(running)
+    for i, sample in enumerate(running):
+        if i < len(steps):
+            oven.time_step = steps[i]
+        oven.board.temp_sensor.temperature = sensor_temperature(sample)
+        oven.step()
+        state = oven.get_state()
+        yield sample, state
+        if state['state'] != "RUNNING":
+            break
+
+def compare(samples, profile, tolerance=0.05):
+    '''
+    replay samples and summarise how far the decisions drifted from the log:
+        ticks            - ticks replayed
+        duty_mae         - mean absolute difference of the pid output (0-1)
+        duty_max         - largest difference of the pid output
+        heat_mismatch    - ticks where one had the elements on and the other off
+        target_mae       - mean absolute difference of the target temperature
+        runtime_drift    - replayed minus logged runtime at the end
+        first_divergence - logged runtime of the first tick where the outputs
+                           differ by more than tolerance, or None
+        ended_early      - True if the replay stopped before the log did
+    '''
+    ticks = 0
+    duty_sum = duty_max = target_sum = 0.0
+    heat_mismatch = 0
+    first_divergence = None
+    runtime_drift = 0.0
+    state = None
+    logged_ticks = len(pid_steps(samples))
+
+    for sample, state in replay(samples, profile):
+        ticks += 1
+        out = state['pidstats'].get('out', 0)
+        logged_out = sample.get('pid_out')
+        if isinstance(logged_out, float):
+            diff = abs(out - logged_out)
+            duty_sum += diff
+            duty_max = max(duty_max, diff)
+            if (out > 0) != (logged_out > 0):
+                heat_mismatch += 1
+            if diff > tolerance and first_divergence is None:
+                first_divergence = sample.get('runtime')
+        if isinstance(sample.get('target'), float):
+            target_sum += abs(state['target'] - sample['target'])
+        if isinstance(sample.get('runtime'), float) and state['state'] == "RUNNING":
+            runtime_drift = state['runtime'] - sample['runtime']
+
+    return {
+        'ticks': ticks,
+        'duty_mae': duty_sum / ticks if ticks else 0,
+        'duty_max': duty_max,
+        'heat_mismatch': heat_mismatch,
+        'target_mae': target_sum / ticks if ticks else 0,
+        'runtime_drift': runtime_drift,
+        'first_divergence': first_divergence,
+        'ended_early': ticks < logged_ticks,
+    }
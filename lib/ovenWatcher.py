@@ -1,14 +1,137 @@
-import threading,logging,json,time,datetime
+import threading,logging,json,collections
+import config
+import ovenFrame
 from oven import Oven
+from ovenHistory import OvenHistory
 log = logging.getLogger(__name__)
 
+ENCODINGS = ('json', 'delta', 'binary')
+
+def state_delta(old, new):
+    '''
+    the entries of new that differ from old. dicts holding the same keys
+    in both are compared entry by entry and sent as a nested delta to
+    merge. keys listed in "removed" are to be deleted before the delta is
+    merged, which is also how a dict whose keys changed gets replaced.
+    '''
+    delta = {}
+    removed = [k for k in old if k not in new]
+    for k, v in new.items():
+        if k not in old:
+            delta[k] = v
+        elif isinstance(v, dict) and isinstance(old[k], dict):
+            if v.keys() == old[k].keys():
+                changed = state_delta(old[k], v)
+                if changed:
+                    delta[k] = changed
+            else:
+                removed.append(k)
+                delta[k] = v
+        elif v != old[k]:
+            delta[k] = v
+    if removed:
+        delta['removed'] = removed
+    return delta
+
+class ObserverQueue(threading.Thread):
+    '''sends messages to one observer from its own thread, so a client that
+    is slow or has gone away only holds up itself. at most maxlen messages
+    wait to be sent, when full the oldest is dropped. with coalesce only the
+    latest message waits.
+
+    with encoding "delta" messages are (keyframe, delta) pairs. the delta
+    is sent unless a message was dropped since the last send, or there is
+    no delta, when the keyframe is sent instead so the client catches up.'''
+    def __init__(self, observer, first=None, maxlen=None, coalesce=None, encoding='json'):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.observer = observer
+        self.first = first
+        self.encoding = encoding
+        self.resync = True
+        if maxlen is None:
+            maxlen = config.status_queue_size
+        if coalesce is None:
+            coalesce = config.status_coalesce
+        self.coalesce = coalesce
+        self.queue = collections.deque(maxlen=1 if coalesce else maxlen)
+        self.ready = threading.Condition()
+        self.closed = False
+        self.sent = 0
+        self.dropped = 0
+        self.start()
+
+    def put(self, message):
+        with self.ready:
+            if self.closed:
+                return
+            if len(self.queue) == self.queue.maxlen:
+                self.dropped += 1
+                self.resync = True
+            self.queue.append(message)
+            self.ready.notify()
+
+    def close(self):
+        with self.ready:
+            self.closed = True
+            self.ready.notify()
+
+    def run(self):
+        # the backlog goes first and is never dropped
+        if self.first is not None and not self.send(self.first):
+            return
+        while True:
+            with self.ready:
+                while not self.queue and not self.closed:
+                    self.ready.wait()
+                if self.closed:
+                    return
+                message = self.queue.popleft()
+                if isinstance(message, tuple):
+                    (keyframe, delta) = message
+                    if self.resync or delta is None:
+                        message = keyframe
+                    else:
+                        message = delta
+                    self.resync = False
+            if not self.send(message):
+                return
+
+    def send(self, message):
+        try:
+            self.observer.send(message)
+            self.sent += 1
+            return True
+        except:
+            log.error("could not write to socket %s" % self.observer)
+            self.close()
+            return False
+
+    def stats(self):
+        environ = getattr(self.observer, 'environ', None) or {}
+        return {
+            'client': environ.get('REMOTE_ADDR', type(self.observer).__name__),
+            'encoding': self.encoding,
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'queued': len(self.queue),
+            'closed': self.closed,
+        }
+
 class OvenWatcher(threading.Thread):
     def __init__(self,oven):
         self.last_profile = None
-        self.last_log = []
+        self.history = OvenHistory()
         self.started = None
         self.recording = False
         self.observers = []
+        self.observers_lock = threading.Lock()
+        # firings are written to disk if a recorder is set
+        self.recorder = None
+        self.last_running = None
+        # ticks, for the delta and binary encodings
+        self.seq = 0
+        self.last_state = None
         threading.Thread.__init__(self)
         self.daemon = True
         self.oven = oven
@@ -28,29 +151,51 @@ class OvenWatcher(threading.Thread):
            
             # record state for any new clients that join
             if oven_state.get("state") == "RUNNING":
-                self.last_log.append(oven_state)
+                self.history.append(oven_state)
+                if self.recorder and self.recording:
+                    self.recorder.sample(oven_state, self.stamp())
+                self.last_running = oven_state
             else:
+                if self.recorder and self.recording:
+                    self.recorder.finish(self.outcome(), self.stamp())
                 self.recording = False
             self.notify_all(oven_state)
-            time.sleep(self.oven.time_step)
+            self.oven.clock.sleep(self.oven.time_step)
    
     def lastlog_subset(self,maxpts=50):
-        '''send about maxpts from lastlog by skipping unwanted data'''
-        totalpts = len(self.last_log)
-        if (totalpts <= maxpts):
-            return self.last_log
-        every_nth = int(totalpts / (maxpts - 1))
-        return self.last_log[::every_nth]
+        '''about maxpts states spread over the whole firing'''
+        return self.history.subset(maxpts)
+
+    def set_recorder(self, recorder):
+        '''write every firing to recorder, a FiringRecorder'''
+        self.recorder = recorder
+
+    def stamp(self):
+        return self.oven.clock.now().timestamp()
+
+    def outcome(self):
+        '''how the firing that just stopped running ended'''
+        last = self.last_running
+        if last and last['runtime'] + self.oven.time_step >= last['totaltime']:
+            return "COMPLETE"
+        return "STOPPED"
 
     def record(self, profile):
+        if self.recorder and self.recording:
+            self.recorder.finish(self.outcome(), self.stamp())
         self.last_profile = profile
-        self.last_log = []
-        self.started = datetime.datetime.now()
+        self.history.clear()
+        self.started = self.oven.clock.now()
         self.recording = True
+        self.last_running = None
         #we just turned on, add first state for nice graph
-        self.last_log.append(self.oven.get_state())
+        state = self.oven.get_state()
+        self.history.append(state)
+        if self.recorder:
+            self.recorder.begin(profile.name, self.stamp())
+            self.recorder.sample(state, self.stamp())
 
-    def add_observer(self,observer):
+    def add_observer(self,observer,encoding='json'):
         if self.last_profile:
             p = {
                 "name": self.last_profile.name,
@@ -66,25 +211,52 @@ class OvenWatcher(threading.Thread):
             'log': self.lastlog_subset(),
             #'started': self.started
         }
-        print(backlog)
         backlog_json = json.dumps(backlog)
-        try:
-            print(backlog_json)
-            observer.send(backlog_json)
-        except:
-            log.error("Could not send backlog to new observer")
-        
-        self.observers.append(observer)
+        with self.observers_lock:
+            self.observers.append(ObserverQueue(observer, first=backlog_json, encoding=encoding))
+
+    def remove_observer(self, observer):
+        with self.observers_lock:
+            for queue in self.observers:
+                if queue.observer is observer:
+                    queue.close()
+            self.observers = [queue for queue in self.observers if not queue.closed]
+
+    def observer_stats(self):
+        '''sent and dropped messages for every connected observer'''
+        with self.observers_lock:
+            return [queue.stats() for queue in self.observers]
+
+    def delta_frames(self, state):
+        '''(keyframe, delta) json for delta clients. the delta holds only
+        what changed since the last tick and is None every
+        config.status_keyframe_interval ticks, so everyone gets a keyframe'''
+        keyframe = dict(state, type="keyframe", seq=self.seq)
+        delta = None
+        if self.last_state is not None and self.seq % config.status_keyframe_interval:
+            delta = state_delta(self.last_state, state)
+            delta.update(type="delta", seq=self.seq)
+            delta = json.dumps(delta)
+        self.last_state = state
+        return (json.dumps(keyframe), delta)
 
     def notify_all(self,message):
-        message_json = json.dumps(message)
-        log.debug("sending to %d clients: %s"%(len(self.observers),message_json))
-        for wsock in self.observers:
-            if wsock:
-                try:
-                    wsock.send(message_json)
-                except:
-                    log.error("could not write to socket %s"%wsock)
-                    self.observers.remove(wsock)
-            else:
-                self.observers.remove(wsock)
+        with self.observers_lock:
+            # forget observers whose socket failed
+            self.observers = [queue for queue in self.observers if not queue.closed]
+            observers = list(self.observers)
+
+        # each encoding is done once per tick, however many clients want it
+        self.seq += 1
+        frames = {}
+        for queue in observers:
+            if queue.encoding not in frames:
+                if queue.encoding == 'delta':
+                    frames['delta'] = self.delta_frames(message)
+                elif queue.encoding == 'binary':
+                    frames['binary'] = ovenFrame.pack(message, self.seq)
+                else:
+                    frames['json'] = json.dumps(message)
+        log.debug("sending to %d clients: %s"%(len(observers),frames))
+        for queue in observers:
+            queue.put(frames[queue.encoding])
@@ -0,0 +1,79 @@
+import collections
+import time
+
+# Thermocouple faults over a sliding window of time. Every reading is
+# added with its stamp and the faults that made it unusable. The readings
+# older than the window are dropped as new ones arrive, so the fault rate
+# always covers exactly the last window seconds, however a burst of
+# faults lines up with the sensor's time_step.
+
+FAULT_TYPES = ('noConnection', 'shortToGround', 'shortToVCC', 'unknownError')
+
+
+class FaultTracker(object):
+    '''
+    bad readings in the last window seconds. add() and percent() are O(1)
+    amortised, each reading being dropped once.
+    '''
+    def __init__(self, window):
+        self.window = window
+        self.readings = collections.deque()
+        self.totals = dict((kind, 0) for kind in FAULT_TYPES)
+        self.clear()
+
+    def clear(self):
+        self.readings.clear()
+        self.first = None
+        self.bad = 0
+        self.counts = dict((kind, 0) for kind in FAULT_TYPES)
+        self.last_fault = None
+        self.last_kinds = ()
+
+    def add(self, stamp, kinds=()):
+        '''a reading taken at stamp (time.monotonic() seconds), kinds being
+        the FAULT_TYPES that made it bad, empty for a good reading'''
+        kinds = tuple(kinds)
+        if self.first is None:
+            self.first = stamp
+        self.readings.append((stamp, kinds))
+        if kinds:
+            self.bad += 1
+            for kind in kinds:
+                self.counts[kind] += 1
+                self.totals[kind] += 1
+            self.last_fault = time.time()
+            self.last_kinds = kinds
+        self.expire(stamp)
+
+    def expire(self, now):
+        while self.readings and self.readings[0][0] <= now - self.window:
+            (stamp, kinds) = self.readings.popleft()
+            if kinds:
+                self.bad -= 1
+                for kind in kinds:
+                    self.counts[kind] -= 1
+
+    def full(self):
+        '''True once readings have been added for a whole window, before
+        that a few early faults would look like a high rate'''
+        return bool(self.readings) and self.readings[-1][0] - self.first >= self.window
+
+    def percent(self):
+        '''percentage of the readings in the window that were bad, 0 until
+        the window is full'''
+        if not self.full():
+            return 0.0
+        return self.bad * 100.0 / len(self.readings)
+
+    def state(self):
+        '''for Oven.get_state, last_fault is a unix time'''
+        return {
+            'window': self.window,
+            'readings': len(self.readings),
+            'bad': self.bad,
+            'percent': self.percent(),
+            'last_fault': self.last_fault,
+            'last_kinds': list(self.last_kinds),
+            'counts': dict(self.counts),
+            'totals': dict(self.totals),
+        }
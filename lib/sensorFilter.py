@@ -0,0 +1,244 @@
+import bisect
+import collections
+import logging
+import math
+
+log = logging.getLogger(__name__)
+
+# Streaming filters for thermocouple readings. Each one is fed a reading
+# at a time with add(value, stamp), which returns the filtered temperature
+# so far. stamp is when the reading was taken in time.monotonic() seconds,
+# or None. The windowed filters ignore it, the exponential and Kalman
+# filters can use it to allow for uneven gaps between readings.
+# config.temperature_filters picks which ones TempSensorReal chains
+# together, see build_filters.
+
+
+class TrimmedMean(object):
+    '''
+    the mean of the last window readings after dropping chop percent of
+    them from each end, the same as sorting the window and slicing it but
+    O(log n) a reading. the readings are kept in arrival order in a deque
+    and in value order in a sorted list, and the sums of the dropped low
+    and high ends are kept up to date as readings come and go.
+    '''
+    # re-add the sums from scratch this often so float errors can't build up
+    resum_every = 1000
+
+    def __init__(self, window=40, chop=25):
+        self.window = window
+        self.chop = chop / 100
+        self.clear()
+
+    def clear(self):
+        self.arrivals = collections.deque()
+        self.sorted = []
+        self.total = 0.0
+        self.low = 0.0
+        self.high = 0.0
+        self.updates = 0
+
+    def __len__(self):
+        return len(self.sorted)
+
+    def trim(self, n):
+        '''readings dropped from each end of a window of n'''
+        return int(n * self.chop)
+
+    def add(self, value, stamp=None):
+        '''add a reading, dropping the oldest once the window is full.
+        returns the trimmed mean'''
+        if len(self.arrivals) >= self.window:
+            self.remove(self.arrivals.popleft())
+        self.insert(value)
+        self.arrivals.append(value)
+
+        self.updates += 1
+        if self.updates % self.resum_every == 0:
+            self.resum()
+        return self.value()
+
+    def insert(self, value):
+        s = self.sorted
+        n = len(s)
+        k = self.trim(n)
+        i = bisect.bisect_right(s, value)
+        s.insert(i, value)
+        self.total += value
+        # value pushes the largest of the low end out of it
+        if i < k:
+            self.low += value - s[k]
+        # or the smallest of the high end out of that
+        if k and i >= n + 1 - k:
+            self.high += value - s[n - k]
+        # the ends grow as the window fills
+        if self.trim(n + 1) > k:
+            self.low += s[k]
+            self.high += s[n - k]
+
+    def remove(self, value):
+        s = self.sorted
+        n = len(s)
+        k = self.trim(n)
+        j = bisect.bisect_left(s, value)
+        # the next one up moves into the low end
+        if j < k:
+            self.low += s[k] - value
+        # or the next one down into the high end
+        if k and j >= n - k:
+            self.high += s[n - k - 1] - value
+        del s[j]
+        self.total -= value
+        if self.trim(n - 1) < k:
+            self.low -= s[k - 1]
+            self.high -= s[n - 1 - k]
+
+    def resum(self):
+        s = self.sorted
+        k = self.trim(len(s))
+        self.total = sum(s)
+        self.low = sum(s[:k])
+        self.high = sum(s[len(s) - k:]) if k else 0.0
+
+    def value(self):
+        n = len(self.sorted)
+        if n == 0:
+            return None
+        k = self.trim(n)
+        return (self.total - self.low - self.high) / (n - 2 * k)
+
+
+class Median(object):
+    '''the median of the last window readings, O(log n) a reading'''
+    def __init__(self, window=5):
+        self.window = window
+        self.clear()
+
+    def clear(self):
+        self.arrivals = collections.deque()
+        self.sorted = []
+
+    def add(self, value, stamp=None):
+        if len(self.arrivals) >= self.window:
+            old = self.arrivals.popleft()
+            del self.sorted[bisect.bisect_left(self.sorted, old)]
+        bisect.insort(self.sorted, value)
+        self.arrivals.append(value)
+        n = len(self.sorted)
+        if n % 2:
+            return self.sorted[n // 2]
+        return (self.sorted[n // 2 - 1] + self.sorted[n // 2]) / 2
+
+
+class Exponential(object):
+    '''exponential moving average, each reading moves the output alpha of
+    the way towards it. with a time_constant in seconds and stamped
+    readings alpha is worked out from the gap since the last reading
+    instead, so a late reading counts for more'''
+    def __init__(self, alpha=0.2, time_constant=None):
+        if not 0 < alpha <= 1:
+            raise ValueError("alpha must be in (0, 1], not %r" % (alpha,))
+        if time_constant is not None and time_constant <= 0:
+            raise ValueError("time_constant must be > 0")
+        self.alpha = alpha
+        self.time_constant = time_constant
+        self.clear()
+
+    def clear(self):
+        self.output = None
+        self.stamp = None
+
+    def add(self, value, stamp=None):
+        alpha = self.alpha
+        if self.time_constant and stamp is not None and self.stamp is not None:
+            alpha = 1 - math.exp(-max(stamp - self.stamp, 0) / self.time_constant)
+        self.stamp = stamp
+        if self.output is None:
+            self.output = value
+        else:
+            self.output += alpha * (value - self.output)
+        return self.output
+
+
+class Kalman(object):
+    '''
+    one dimensional Kalman filter for a temperature that wanders by about
+    sqrt(process_noise) degrees between readings, read by a thermocouple
+    with a variance of measurement_noise degrees squared. a small
+    process_noise smooths more and follows changes more slowly. with
+    drift, in degrees squared a second, and stamped readings the wander
+    is worked out from the gap since the last reading instead.
+    '''
+    def __init__(self, process_noise=0.01, measurement_noise=4.0, drift=None):
+        if process_noise <= 0 or measurement_noise <= 0:
+            raise ValueError("process_noise and measurement_noise must be > 0")
+        if drift is not None and drift <= 0:
+            raise ValueError("drift must be > 0")
+        self.q = process_noise
+        self.r = measurement_noise
+        self.drift = drift
+        self.clear()
+
+    def clear(self):
+        self.estimate = None
+        self.variance = None
+        self.stamp = None
+
+    def add(self, value, stamp=None):
+        q = self.q
+        if self.drift and stamp is not None and self.stamp is not None:
+            q = self.drift * max(stamp - self.stamp, 0)
+        self.stamp = stamp
+        if self.estimate is None:
+            self.estimate = value
+            self.variance = self.r
+            return self.estimate
+        # predict, the temperature may have wandered
+        self.variance += q
+        # update with the reading
+        gain = self.variance / (self.variance + self.r)
+        self.estimate += gain * (value - self.estimate)
+        self.variance *= 1 - gain
+        return self.estimate
+
+
+class FilterChain(object):
+    '''feeds each reading through stages in turn'''
+    def __init__(self, stages):
+        self.stages = list(stages)
+
+    def clear(self):
+        for stage in self.stages:
+            stage.clear()
+
+    def add(self, value, stamp=None):
+        for stage in self.stages:
+            value = stage.add(value, stamp)
+        return value
+
+
+FILTERS = {
+    'median': Median,
+    'trimmed_mean': TrimmedMean,
+    'exponential': Exponential,
+    'kalman': Kalman,
+}
+
+def build_filters(spec):
+    '''
+    a FilterChain from a list of (name, options) pairs, for example
+        [("median", {"window": 5}), ("kalman", {"measurement_noise": 4})]
+    names are the keys of FILTERS, options their keyword arguments
+    '''
+    stages = []
+    for item in spec:
+        if isinstance(item, str):
+            (name, options) = (item, {})
+        else:
+            (name, options) = item
+        if name not in FILTERS:
+            raise ValueError("unknown temperature filter %r, use one of %s" %
+                (name, ", ".join(sorted(FILTERS))))
+        stages.append(FILTERS[name](**options))
+    log.info("temperature filters: %s" % ", ".join(type(stage).__name__ for stage in stages))
+    return FilterChain(stages)
@@ -3,6 +3,8 @@ var state_last = "";
 var graph = [ 'profile', 'live'];
 var points = [];
 var profiles = [];
+var profiles_revision = null;
+var profiles_epoch = null;
 var time_mode = 0;
 var selected_profile = 0;
 var selected_profile_name = 'cone-05-long-bisque.json';
@@ -19,7 +21,8 @@ if (window.location.protocol == 'https:') {
     protocol = 'wss:';
 }
 var host = "" + protocol + "//" + window.location.hostname + ":" + window.location.port;
-var ws_status = new WebSocket(host+"/status");
+var ws_status = new WebSocket(host+"/status?encoding=delta");
+var status_state = null;
 var ws_control = new WebSocket(host+"/control");
 var ws_config = new WebSocket(host+"/config");
 var ws_storage = new WebSocket(host+"/storage");
@@ -61,6 +64,71 @@ function updateProfile(id)
     graph.plot = $.plot("#graph_container", [ graph.profile, graph.live ] , getOptions());
 }
 
+function syncProfiles()
+{
+    // the server replies with what changed since the revision we hold,
+    // or every profile if we have none yet
+    var sync = { "cmd": "SYNC", "revision": profiles_revision, "epoch": profiles_epoch };
+    ws_storage.send(JSON.stringify(sync));
+}
+
+function applyProfileChanges(message)
+{
+    if (message.full)
+    {
+        profiles = message.profiles;
+    }
+    else
+    {
+        var gone = message.deleted.concat(message.profiles.map(function(a) {return a.name;}));
+        profiles = profiles.filter(function(a) {return $.inArray(a.name, gone) === -1;});
+        profiles = profiles.concat(message.profiles);
+    }
+    profiles.sort(function(a, b) {return a.name < b.name ? -1 : (a.name > b.name ? 1 : 0);});
+    profiles_revision = message.revision;
+    profiles_epoch = message.epoch;
+}
+
+function applyDelta(state, delta)
+{
+    // merge the fields that changed since the last status message,
+    // after deleting the ones it removes or replaces
+    $.each(delta.removed || [], function(i, gone) { delete state[gone]; });
+    $.each(delta, function(k, v) {
+        if (k == "removed")
+        {
+            return;
+        }
+        if ($.isPlainObject(v) && $.isPlainObject(state[k]))
+        {
+            applyDelta(state[k], v);
+        }
+        else
+        {
+            state[k] = v;
+        }
+    });
+}
+
+function loadFiringHistory()
+{
+    // the backlog is only a few points, redraw a running firing from the
+    // recorded history at about one point per pixel of the chart
+    $.getJSON('/api/history', function(firings) {
+        if (!$.isArray(firings) || firings.length == 0 || firings[0].state != "RUNNING") return;
+        var points = Math.max(50, $('#graph_container').width());
+        $.getJSON('/api/history/' + firings[0].id + '?points=' + points, function(history) {
+            if (!history.points || history.points.length == 0) return;
+            var live = history.points.map(function(p) { return [p.runtime, p.temperature]; });
+            // keep the updates that arrived while the history loaded
+            var last = live[live.length-1][0];
+            $.each(graph.live.data, function(i, v) { if (v[0] > last) live.push(v); });
+            graph.live.data = live;
+            graph.plot = $.plot("#graph_container", [ graph.profile, graph.live ] , getOptions());
+        });
+    });
+}
+
 function deleteProfile()
 {
     var profile = { "type": "profile", "data": "", "name": selected_profile_name };
@@ -71,7 +139,7 @@ function deleteProfile()
 
     ws_storage.send(delete_cmd);
 
-    ws_storage.send('GET');
+    syncProfiles();
     selected_profile_name = profiles[0].name;
 
     state="IDLE";
@@ -279,7 +347,7 @@ function enterEditMode()
 function leaveEditMode()
 {
     selected_profile_name = $('#form_profile_name').val();
-    ws_storage.send('GET');
+    syncProfiles();
     state="IDLE";
     $('#edit').hide();
     $('#profile_selector').show();
@@ -506,6 +574,17 @@ $(document).ready(function()
             console.log(e.data);
 
             x = JSON.parse(e.data);
+            if (x.type == "keyframe")
+            {
+                status_state = x;
+            }
+            else if (x.type == "delta")
+            {
+                // wait for a keyframe to apply it to
+                if (status_state === null) return;
+                applyDelta(status_state, x);
+                x = $.extend(true, {}, status_state);
+            }
             if (x.type == "backlog")
             {
                 if (x.profile)
@@ -523,6 +602,7 @@ $(document).ready(function()
                     graph.live.data.push([v.runtime, v.temperature]);
                     graph.plot = $.plot("#graph_container", [ graph.profile, graph.live ] , getOptions());
                 });
+                loadFiringHistory();
             }
 
             if(state!="EDIT")
@@ -636,6 +716,31 @@ $(document).ready(function()
             console.log ("control socket has been opened")
             console.log (e.data);
             x = JSON.parse(e.data);
+            if (x.type == "simulation_summary")
+            {
+                var summary = "<b>Simulation of " + x.profile + "</b>";
+                if (x.completed)
+                {
+                    summary += "<br/>Overshoot: " + parseFloat(x.overshoot).toFixed(1) + "&deg;" + temp_scale_display +
+                               "<br/>Behind schedule: " + new Date(x.lag * 1000).toISOString().substr(11, 8) +
+                               "<br/>Cost: " + x.currency_type + parseFloat(x.cost).toFixed(2);
+                }
+                else
+                {
+                    summary += "<br/>The kiln did not finish the schedule";
+                }
+                $.bootstrapGrowl("<span class=\"glyphicon glyphicon-exclamation-sign\"></span> " + summary, {
+                ele: 'body', // which element to append to
+                type: x.completed ? 'info' : 'error', // (null, 'info', 'error', 'success')
+                offset: {from: 'top', amount: 250}, // 'top', or 'bottom'
+                align: 'center', // ('left', 'right', or 'center')
+                width: 385, // (integer, or 'auto')
+                delay: 0,
+                allow_dismiss: true,
+                stackup_spacing: 10 // spacing between consecutively stacked growls.
+                });
+                return;
+            }
             graph.live.data.push([x.runtime, x.temperature]);
             graph.plot = $.plot("#graph_container", [ graph.profile, graph.live ] , getOptions());
 
@@ -645,7 +750,7 @@ $(document).ready(function()
 
         ws_storage.onopen = function()
         {
-            ws_storage.send('GET');
+            syncProfiles();
         };
 
 
@@ -672,9 +777,15 @@ $(document).ready(function()
                 return;
             }
 
-            //the message is an array of profiles
-            //FIXME: this should be better, maybe a {"profiles": ...} container?
-            profiles = message;
+            if (message.type == "profiles")
+            {
+                applyProfileChanges(message);
+            }
+            else
+            {
+                //the message is an array of profiles
+                profiles = message;
+            }
             //delete old options in select
             $('#e2').find('option').remove().end();
             // check if current selected value is a valid profile name
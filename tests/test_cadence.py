@@ -0,0 +1,54 @@
+import os
+import sys
+
+import pytest
+
+root = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, 'lib'))
+
+from oven import Cadence
+
+
+class FakeTime(object):
+    '''time.monotonic and time.sleep where sleeping and work only move
+    the clock on'''
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        assert seconds >= 0
+        self.now += seconds
+
+def cadence(period=0.5):
+    clock = FakeTime()
+    return (Cadence(period, clock.monotonic, clock.sleep), clock)
+
+def test_wakes_on_whole_periods_whatever_the_work_takes():
+    (c, clock) = cadence()
+    start = c.wait()
+    for i in range(1, 100):
+        clock.now += 0.1 + (i % 3) * 0.1
+        assert c.wait() == pytest.approx(start + i * 0.5)
+    assert c.stats() == {'period': 0.5, 'ticks': 99, 'overruns': 0, 'skipped': 0}
+
+def test_overrun_skips_to_the_next_tick_on_time():
+    (c, clock) = cadence()
+    start = c.wait()
+    clock.now += 1.2
+    # ticks at 0.5 and 1.0 were missed, it carries on at 1.5
+    assert c.wait() == pytest.approx(start + 1.5)
+    assert c.stats() == {'period': 0.5, 'ticks': 3, 'overruns': 1, 'skipped': 2}
+    clock.now += 0.2
+    assert c.wait() == pytest.approx(start + 2.0)
+    assert c.overruns == 1
+
+def test_overrun_by_whole_periods():
+    (c, clock) = cadence()
+    start = c.wait()
+    clock.now += 1.0 + 1e-9
+    assert c.wait() == pytest.approx(start + 1.5)
+    assert c.skipped == 2
@@ -0,0 +1,61 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'lib'))
+
+import ovenFrame
+from sensorFaults import FaultTracker
+
+
+def running_state():
+    faults = FaultTracker(4)
+    for stamp in range(6):
+        faults.add(stamp, ['noConnection', 'unknownError'] if stamp == 5 else [])
+    return {
+        'cost': 0.25, 'runtime': 120.0, 'temperature': 512.5, 'target': 520.0,
+        'state': 'RUNNING', 'heat': 1.0, 'totaltime': 3600, 'kwh_rate': 0.33631,
+        'currency_type': '£', 'profile': 'cone-05', 'status': '',
+        'pidstats': {'time': 1686902305.0, 'timeDelta': 2.0, 'setpoint': 520.0,
+                     'ispoint': 512.5, 'err': 7.5, 'errDelta': 0.5, 'p': 187.5,
+                     'i': 12.0, 'd': 50.0, 'kp': 25, 'ki': 10, 'kd': 200,
+                     'pid': 0.8, 'out': 1, 'status': 'heating'},
+        'faults': faults.state(),
+        'sampling': {'period': 0.2, 'ticks': 600, 'overruns': 2, 'skipped': 3},
+    }
+
+def test_round_trip():
+    state = running_state()
+    got = ovenFrame.unpack(ovenFrame.pack(state, seq=7))
+    assert got.pop('seq') == 7
+    assert got == state
+
+def test_idle_state_round_trip():
+    state = {'cost': 0, 'runtime': 0, 'temperature': 23.25, 'target': 0,
+             'state': 'IDLE', 'heat': 0, 'totaltime': 0, 'kwh_rate': 0.33631,
+             'currency_type': '£', 'profile': None, 'status': '', 'pidstats': {},
+             'sampling': None}
+    got = ovenFrame.unpack(ovenFrame.pack(state))
+    got.pop('seq')
+    assert got == state
+    assert 'faults' not in got
+
+def test_missing_numbers_come_back_as_none():
+    state = running_state()
+    state['target'] = None
+    state['pidstats']['errDelta'] = 'n/a'
+    state['faults']['last_fault'] = None
+    got = ovenFrame.unpack(ovenFrame.pack(state))
+    assert got['target'] is None
+    assert got['pidstats']['errDelta'] is None
+    assert got['faults']['last_fault'] is None
+
+def test_bad_frames():
+    frame = ovenFrame.pack(running_state())
+    with pytest.raises(ovenFrame.FrameError):
+        ovenFrame.unpack(b'garbage')
+    with pytest.raises(ovenFrame.FrameError):
+        ovenFrame.unpack(frame[:len(frame) // 2])
+    with pytest.raises(ovenFrame.FrameError):
+        ovenFrame.unpack(b'KF\x01' + frame[3:])
@@ -0,0 +1,69 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'lib'))
+
+from ovenHistory import OvenHistory, downsample
+
+
+def firing(samples=20000):
+    history = OvenHistory()
+    for i in range(samples):
+        history.append({'runtime': i * 2, 'temperature': (i * 7) % 500})
+    return history
+
+def test_subset_keeps_first_and_last_with_few_points():
+    history = firing()
+    for maxpts in (2, 3):
+        points = history.subset(maxpts)
+        assert len(points) == maxpts
+        assert points[0]['runtime'] == 0
+        assert points[-1]['runtime'] == 39998
+
+def test_subset_of_one_point_is_the_latest():
+    assert [p['runtime'] for p in firing().subset(1)] == [39998]
+
+def test_subset_never_exceeds_maxpts():
+    history = firing()
+    for maxpts in range(2, 60):
+        points = history.subset(maxpts)
+        assert len(points) <= maxpts
+        assert points[-1]['runtime'] == 39998
+
+def test_subset_of_short_firing():
+    history = firing(1)
+    assert [p['runtime'] for p in history.subset(3)] == [0]
+
+def test_downsample_of_one_point_is_the_latest():
+    rows = [(i * 2, (i * 7) % 500) for i in range(20000)]
+    points = downsample(rows, 1, key=lambda row: row[1])
+    assert [row[0] for row in points] == [p['runtime'] for p in firing().subset(1)]
+    for maxpts in (2, 3):
+        points = downsample(rows, maxpts, key=lambda row: row[1])
+        assert len(points) <= maxpts
+        assert points[0] == rows[0] and points[-1] == rows[-1]
+
+def test_downsample_keeps_peaks():
+    rows = [(i, 100.0) for i in range(10000)]
+    rows[1234] = (1234, 900.0)
+    rows[5678] = (5678, -50.0)
+    points = downsample(rows, 20, key=lambda row: row[1])
+    assert len(points) <= 20
+    assert points[0] == rows[0] and points[-1] == rows[-1]
+    assert rows[1234] in points and rows[5678] in points
+
+def test_downsample_of_few_rows():
+    rows = [(0, 1.0), (1, 2.0)]
+    assert downsample(rows, 5, key=lambda row: row[1]) == rows
+    assert downsample(rows, 1, key=lambda row: row[1]) == [rows[-1]]
+
+def test_memory_is_fixed_however_long_the_firing():
+    history = OvenHistory(buckets=256)
+    # 30 hours at a 2 second time_step, with an overshoot early on
+    for i in range(54000):
+        history.append({'runtime': i * 2, 'temperature': 900.0 if i == 100 else 500.0})
+        assert len(history.shape.closed) < 2 * 256
+    assert len(history) == 54000
+    points = history.subset(50)
+    assert len(points) <= 50
+    assert max(p['temperature'] for p in points) == 900.0
@@ -0,0 +1,59 @@
+import copy
+import os
+import sys
+
+root = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, 'lib'))
+
+from ovenWatcher import state_delta
+
+
+def apply_delta(state, delta):
+    '''the merge kiln-logger.py and the web UI do'''
+    for gone in delta.get('removed', []):
+        state.pop(gone, None)
+    for k, v in delta.items():
+        if k == 'removed':
+            continue
+        if isinstance(v, dict) and isinstance(state.get(k), dict):
+            apply_delta(state[k], v)
+        else:
+            state[k] = v
+
+def check(old, new):
+    delta = state_delta(old, new)
+    state = copy.deepcopy(old)
+    apply_delta(state, delta)
+    assert state == new
+    return delta
+
+def test_only_changes_are_sent():
+    old = {'temperature': 100.0, 'state': 'RUNNING', 'pidstats': {'p': 1.0, 'i': 2.0}}
+    new = {'temperature': 101.0, 'state': 'RUNNING', 'pidstats': {'p': 1.0, 'i': 3.0}}
+    assert check(old, new) == {'temperature': 101.0, 'pidstats': {'i': 3.0}}
+
+def test_no_changes():
+    state = {'temperature': 100.0, 'pidstats': {'p': 1.0}}
+    assert check(state, copy.deepcopy(state)) == {}
+
+def test_removed_keys():
+    old = {'temperature': 100.0, 'profile': 'cone-05'}
+    new = {'temperature': 100.0}
+    assert check(old, new) == {'removed': ['profile']}
+
+def test_dict_with_other_keys_is_replaced():
+    # idle pidstats is {}, merging a run's pidstats into it must not keep
+    # stale keys, nor merge {} into a full dict
+    full = {'pidstats': {'p': 1.0, 'i': 2.0}}
+    assert check(full, {'pidstats': {}}) == {'pidstats': {}, 'removed': ['pidstats']}
+    assert check({'pidstats': {}}, full) == {'pidstats': {'p': 1.0, 'i': 2.0}, 'removed': ['pidstats']}
+
+def test_nested_removal():
+    old = {'faults': {'counts': {'noConnection': 1, 'shortToVCC': 0}, 'bad': 1}}
+    new = {'faults': {'counts': {'noConnection': 1}, 'bad': 1}}
+    check(old, new)
+
+def test_value_becomes_a_dict():
+    check({'sampling': None}, {'sampling': {'period': 0.2, 'ticks': 1}})
+    check({'sampling': {'period': 0.2, 'ticks': 1}}, {'sampling': None})
@@ -0,0 +1,54 @@
+import json
+import os
+import sys
+
+import pytest
+
+root = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, 'lib'))
+
+import config
+from oven import Profile, ProfileError, compile_segments
+
+
+def test_ramp_hold_and_cool():
+    segments = [{"rate": 100, "target": 600}, {"hold": 10}, {"rate": 200, "target": 200}]
+    assert compile_segments(segments, start=20) == [
+        [0, 20], [20880, 600], [21480, 600], [28680, 200]]
+
+def test_max_rate():
+    points = compile_segments([{"rate": "max", "target": 1000}])
+    assert points == [[0, 0], [1000 * 3600 / config.max_ramp, 1000]]
+
+def test_empty_steps_add_no_points():
+    assert compile_segments([{"hold": 0}, {"rate": 50, "target": 0}]) == [[0, 0]]
+
+def test_cached_points_are_not_shared():
+    segments = [{"rate": 100, "target": 600}]
+    compile_segments(segments)[1][1] = -1
+    assert compile_segments(segments) == [[0, 0], [21600, 600]]
+
+@pytest.mark.parametrize('segments', [
+    [],
+    "fast",
+    [{"hold": -1}],
+    [{"hold": "10"}],
+    [{"rate": 0, "target": 600}],
+    [{"rate": True, "target": 600}],
+    [{"rate": 100}],
+    [{"rate": 100, "target": 600, "hold": 10}],
+    [{"rate": 100, "target": None}],
+    [600],
+    [{"rate": 100, "target": float('nan')}],
+])
+def test_bad_segments(segments):
+    with pytest.raises(ProfileError):
+        compile_segments(segments)
+
+def test_profile_from_segments():
+    profile = Profile(json.dumps({"name": "bisque", "type": "profile", "start": 20,
+        "segments": [{"rate": 100, "target": 120}, {"hold": 30}],
+        "data": [[0, 0], [60, 1000]]}))
+    assert profile.data == [[0, 20], [3600, 120], [5400, 120]]
+    assert profile.get_target_temperature(1800) == pytest.approx(70)
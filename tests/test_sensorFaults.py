@@ -0,0 +1,46 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'lib'))
+
+from sensorFaults import FaultTracker
+
+
+def test_percent_is_zero_until_the_window_is_full():
+    faults = FaultTracker(10)
+    for stamp in range(10):
+        faults.add(stamp, ['noConnection'])
+        assert faults.percent() == 0.0
+    faults.add(10, ['noConnection'])
+    assert faults.full()
+    assert faults.percent() == 100.0
+
+def test_old_readings_leave_the_window():
+    faults = FaultTracker(10)
+    for stamp in range(20):
+        faults.add(stamp, ['shortToVCC'] if stamp < 5 else [])
+    assert faults.bad == 0
+    assert faults.percent() == 0.0
+    assert faults.counts['shortToVCC'] == 0
+    assert faults.totals['shortToVCC'] == 5
+
+def test_percent_covers_exactly_the_window():
+    faults = FaultTracker(10)
+    # a reading a second, every other one bad
+    for stamp in range(100):
+        faults.add(stamp, ['noConnection'] if stamp % 2 else [])
+    state = faults.state()
+    assert state['readings'] == 10
+    assert state['bad'] == 5
+    assert state['percent'] == 50.0
+    assert state['counts']['noConnection'] == 5
+    assert state['last_kinds'] == ['noConnection']
+
+def test_clear_keeps_the_totals():
+    faults = FaultTracker(10)
+    faults.add(0, ['unknownError', 'shortToGround'])
+    faults.clear()
+    assert faults.bad == 0
+    assert faults.last_fault is None
+    assert faults.totals['unknownError'] == 1
+    assert faults.totals['shortToGround'] == 1
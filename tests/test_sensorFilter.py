@@ -0,0 +1,55 @@
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'lib'))
+
+from sensorFilter import TrimmedMean, build_filters
+
+
+def trimmed_mean(temps, chop=25):
+    '''the sort and slice TempSensor.get_avg_temp used to do'''
+    temps = sorted(temps)
+    items = int(len(temps) * chop / 100)
+    temps = temps[items:len(temps) - items]
+    return sum(temps) / len(temps)
+
+@pytest.mark.parametrize('window,chop', [(40, 25), (10, 25), (7, 10), (5, 0), (1, 25), (4, 49)])
+def test_trimmed_mean_matches_sorting_the_window(window, chop):
+    rng = random.Random(window * 100 + chop)
+    f = TrimmedMean(window, chop)
+    readings = []
+    for i in range(3000):
+        # repeated values and spikes, the awkward cases for the ends
+        value = rng.choice((rng.gauss(500, 5), 20.0, 20.0, 1e4))
+        readings.append(value)
+        got = f.add(value)
+        assert got == pytest.approx(trimmed_mean(readings[-window:], chop), rel=1e-9, abs=1e-9)
+    assert len(f) == window
+
+def test_trimmed_mean_does_not_drift():
+    # adding and taking away huge readings leaves float error in the sums,
+    # resum puts them right every resum_every readings
+    rng = random.Random(1)
+    f = TrimmedMean(40, 25)
+    every = TrimmedMean.resum_every
+    for i in range(2 * every - 40):
+        f.add(rng.choice((1e12, 0.1, rng.random())))
+    readings = [rng.random() for i in range(40)]
+    for value in readings:
+        got = f.add(value)
+    assert got == pytest.approx(trimmed_mean(readings), abs=1e-12)
+
+def test_trimmed_mean_clear():
+    f = TrimmedMean(4, 25)
+    for value in (1, 2, 3, 4):
+        f.add(value)
+    f.clear()
+    assert f.value() is None
+    assert f.add(10.0) == 10.0
+
+def test_build_filters_rejects_unknown_names():
+    with pytest.raises(ValueError):
+        build_filters([["no_such_filter", {}]])